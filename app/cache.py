@@ -0,0 +1,135 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# ==========================================
+#  跨進程共享快取 (SQLite)
+# ==========================================
+# lru_cache 只存在單一進程內，多 worker 時每個進程都會重新下載與重算。
+# 這裡改以同一個 SQLite 檔案 (WAL 模式) 作為所有 worker 共用的快取後端，
+# 值以 pickle 序列化 (DataFrame / dict 皆可)。
+# 寫入時定期清掉過期資料，並以筆數上限由最舊的開始淘汰，避免檔案無限成長。
+
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / "data" / "cache.sqlite3"
+DEFAULT_MAX_ROWS = 5000
+PRUNE_INTERVAL = 60.0  # 秒；每個進程最多每隔這麼久清理一次
+
+# 排程匯入的完整歷史 (ingest)，由下一次匯入覆寫，不隨 TTL 過期也不計入筆數上限
+PERSISTENT_NAMESPACES = ("ohlcv_full", "ohlcv_full_version")
+
+
+class SharedCache:
+    """ 以 SQLite 實作的跨進程 key-value 快取 (namespace + key) """
+
+    def __init__(self, path=None, ttl=None, max_rows=None):
+        self.path = Path(path or os.environ.get("BACKTEST_CACHE_PATH", DEFAULT_CACHE_PATH))
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._last_prune = 0.0
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_created_at ON cache (created_at)")
+        conn.commit()
+
+    def _connect(self):
+        # sqlite3 連線不可跨執行緒使用，每個執行緒 (executor) 各自建立一條
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            row = self._connect().execute(
+                "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[Cache] 讀取失敗: {e}")
+            return None
+        if row is None: return None
+        value, created_at = row
+        if ttl and time.time() - created_at > ttl: return None
+        try:
+            return pickle.loads(value)
+        except Exception:
+            return None
+
+    def set(self, namespace, key, value):
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, created_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time()),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"[Cache] 寫入失敗: {e}")
+            return
+        if time.time() - self._last_prune > PRUNE_INTERVAL:
+            self.prune()
+
+    def prune(self):
+        """ 刪除過期資料，超過筆數上限時由最舊的開始淘汰 (PERSISTENT_NAMESPACES 除外) """
+        self._last_prune = time.time()
+        placeholders = ", ".join("?" * len(PERSISTENT_NAMESPACES))
+        try:
+            conn = self._connect()
+            if self.ttl:
+                conn.execute(
+                    f"DELETE FROM cache WHERE created_at < ? AND namespace NOT IN ({placeholders})",
+                    (time.time() - self.ttl, *PERSISTENT_NAMESPACES),
+                )
+            if self.max_rows:
+                conn.execute(
+                    "DELETE FROM cache WHERE rowid IN ("
+                    f" SELECT rowid FROM cache WHERE namespace NOT IN ({placeholders})"
+                    " ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (*PERSISTENT_NAMESPACES, self.max_rows),
+                )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"[Cache] 清理失敗: {e}")
+
+    def clear(self, namespace=None):
+        conn = self._connect()
+        if namespace is None:
+            conn.execute("DELETE FROM cache")
+        else:
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+        conn.commit()
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """
+    取得進程內唯一的 SharedCache
+    (TTL 由 BACKTEST_CACHE_TTL 設定，預設 6 小時；筆數上限由 BACKTEST_CACHE_MAX_ROWS 設定，0 為不限)
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                ttl = float(os.environ.get("BACKTEST_CACHE_TTL", 6 * 3600))
+                max_rows = int(os.environ.get("BACKTEST_CACHE_MAX_ROWS", DEFAULT_MAX_ROWS))
+                _shared_cache = SharedCache(ttl=ttl, max_rows=max_rows)
+    return _shared_cache
@@ -0,0 +1,107 @@
+import argparse
+import random
+import sys
+from pathlib import Path
+
+# ==========================================
+#  定期定額矩陣驗證
+# ==========================================
+# dca_matrix 以向量化公式重現 periodic 模式的 UniversalStrategy，不逐格執行 backtesting.py。
+# 這裡從矩陣中抽樣，以 /api/backtest 相同的 _compute_backtest 實際回測，逐格比對期末資產與投入資金；
+# 修改策略或 dca_matrix 後執行，確認兩者仍然一致。使用本機 CSV 數據，不會連到 Yahoo。
+#
+#   python -m app.dca_check AAPL TSLA --cash 50000 --amounts 3000,5000 --fees 0,1 --samples 30
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = ROOT_DIR / "data"
+
+DEFAULT_TICKERS = ["AAPL", "TSLA", "2303.TW"]
+TOLERANCE = 1.0  # _compute_backtest 的期末資產四捨五入到整數
+
+
+def load_daily(ticker, start, end, source_dir=None):
+    """ 與 load_backtest_data 相同的清洗流程 (不經過共享快取) """
+    from .ingest import get_provider, normalize_ohlcv, normalize_ticker
+
+    ticker = normalize_ticker(ticker)
+    df = normalize_ohlcv(get_provider("csv", source_dir or DATA_DIR).download([ticker], start, end).get(ticker))
+    return ticker, (None if df is None else df.dropna())
+
+
+def check_ticker(ticker, start, end, cash, days, amounts, fees, samples, rng, source_dir=None):
+    """ 抽樣比對單一股票，回傳 [(day, amount, fee, 矩陣期末資產, 回測期末資產, 矩陣投入, 回測投入), ...] """
+    from . import main as app_main
+    from .schemas import BacktestRequest
+    from .strategy import contribution_schedule, dca_matrix
+
+    ticker, df = load_daily(ticker, start, end, source_dir)
+    if df is None or len(df) < 2:
+        print(f"[DCA Check] {ticker}: 找不到數據，略過")
+        return []
+
+    close = df["Close"].to_numpy(dtype=float)
+    matrix = dca_matrix(df.index, close, cash, days, amounts, fees)
+    cells = [(d, a, f) for d in range(len(days)) for a in range(len(amounts)) for f in range(len(fees))]
+    # 最後一根 K 棒剛好入金的扣款日最容易出錯，一律納入
+    edge = {d for d, day in enumerate(days) if contribution_schedule(df.index, [day], 1.0)[0][-1] > 0}
+    picked = [c for c in cells if c[0] in edge]
+    rest = [c for c in cells if c[0] not in edge]
+    picked += rng.sample(rest, min(max(samples - len(picked), 0), len(rest)))
+
+    rows = []
+    for d, a, f in picked:
+        params = BacktestRequest(
+            ticker=ticker, start_date=start, end_date=end, cash=cash, strategy_mode="periodic",
+            monthly_contribution_amount=amounts[a], monthly_contribution_fee=fees[f],
+            monthly_contribution_days=[days[d]],
+        )
+        result = app_main._compute_backtest(params, df, ticker)
+        rows.append((days[d], amounts[a], fees[f], float(matrix["final_equity"][d, a, f]), result["final_equity"],
+                     float(matrix["invested"][d, a, f]), result["total_invested"]))
+    return rows
+
+
+def parse_floats(text):
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比對定期定額矩陣與實際回測")
+    parser.add_argument("tickers", nargs="*", default=DEFAULT_TICKERS)
+    parser.add_argument("--source-dir", default=str(DATA_DIR), help="本機 CSV 數據目錄")
+    parser.add_argument("--start", default="2023-01-01")
+    parser.add_argument("--end", default="2025-12-01")
+    parser.add_argument("--cash", type=float, default=50000.0)
+    parser.add_argument("--days", default=",".join(str(d) for d in range(1, 29)))
+    parser.add_argument("--amounts", default="3000,5000")
+    parser.add_argument("--fees", default="0,1")
+    parser.add_argument("--samples", type=int, default=20, help="每檔股票抽樣的格數 (另含最後一根入金的扣款日)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    days = sorted({int(d) for d in args.days.split(",") if d.strip()})
+    amounts, fees = parse_floats(args.amounts), parse_floats(args.fees)
+    if max(fees) >= min(amounts):
+        parser.error("手續費必須小於所有扣款金額 (與 /api/dca/matrix 相同)")
+    rng = random.Random(args.seed)
+
+    from . import main as app_main
+    app_main.load_heavy_modules()
+
+    checked = mismatched = 0
+    for ticker in args.tickers:
+        rows = check_ticker(ticker, args.start, args.end, args.cash, days, amounts, fees,
+                            args.samples, rng, args.source_dir)
+        for day, amount, fee, matrix_equity, bt_equity, matrix_invested, bt_invested in rows:
+            checked += 1
+            if abs(matrix_equity - bt_equity) > TOLERANCE or abs(matrix_invested - bt_invested) > 0.01:
+                mismatched += 1
+                print(f"[DCA Check] {ticker} 第 {day} 日 / 金額 {amount:g} / 手續費 {fee:g}: "
+                      f"矩陣 {matrix_equity:.2f} ({matrix_invested:.2f}) vs 回測 {bt_equity:.2f} ({bt_invested:.2f})")
+
+    print(f"[DCA Check] 比對 {checked} 格，不一致 {mismatched} 格")
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
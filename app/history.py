@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from .ingest import normalize_ticker
+
+# ==========================================
+#  回測歷史紀錄 (SQLite)
+# ==========================================
+# 每次回測的請求參數、績效摘要與壓縮後的曲線數據都存進 runs 表，
+# 可依股票代碼 / 模式篩選並依績效指標排序，比較時不必重新回測。
+
+DEFAULT_HISTORY_PATH = Path(__file__).resolve().parent.parent / "data" / "history.sqlite3"
+
+# 可排序欄位 (皆有索引)；只接受白名單內的欄位名稱，避免 SQL injection
+SORTABLE_COLUMNS = [
+    "created_at", "total_return", "annual_return", "sharpe_ratio",
+    "max_drawdown", "win_rate", "profit_factor", "final_equity", "total_trades",
+]
+
+LIST_COLUMNS = [
+    "id", "created_at", "ticker", "strategy_mode", "start_date", "end_date",
+    "final_equity", "total_return", "annual_return", "sharpe_ratio",
+    "max_drawdown", "win_rate", "profit_factor", "total_trades", "params",
+]
+
+
+class RunHistory:
+    """ 回測紀錄存放區，payload 為 zlib 壓縮後的二進位結果 """
+
+    def __init__(self, path=None):
+        self.path = Path(path or os.environ.get("BACKTEST_HISTORY_PATH", DEFAULT_HISTORY_PATH))
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                request_hash TEXT NOT NULL UNIQUE,
+                created_at REAL NOT NULL,
+                ticker TEXT NOT NULL,
+                strategy_mode TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                final_equity REAL,
+                total_return REAL,
+                annual_return REAL,
+                sharpe_ratio REAL,
+                max_drawdown REAL,
+                win_rate REAL,
+                profit_factor REAL,
+                total_trades INTEGER,
+                params TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                payload BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_runs_created ON runs (created_at);
+            CREATE INDEX IF NOT EXISTS idx_runs_ticker ON runs (ticker, created_at);
+            CREATE INDEX IF NOT EXISTS idx_runs_mode ON runs (strategy_mode, created_at);
+            CREATE INDEX IF NOT EXISTS idx_runs_ticker_mode ON runs (ticker, strategy_mode, created_at);
+            """
+        )
+        # 每個績效欄位各建 (欄位)、(代碼, 欄位)、(模式, 欄位)、(代碼, 模式, 欄位) 索引 (隱含 id 為最後一欄)，
+        # 篩選後依績效排序時可直接沿索引取出該頁，不必排序所有符合條件的紀錄
+        for col in SORTABLE_COLUMNS[1:]:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_runs_{col} ON runs ({col})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_runs_ticker_{col} ON runs (ticker, {col})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_runs_mode_{col} ON runs (strategy_mode, {col})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_runs_ticker_mode_{col} ON runs (ticker, strategy_mode, {col})")
+        conn.commit()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, request_hash, params, summary, payload):
+        """ 寫入一筆回測紀錄；相同請求重跑時覆寫舊紀錄，回傳 run id """
+        conn = self._connect()
+        row = {
+            "request_hash": request_hash,
+            "created_at": time.time(),
+            "ticker": summary.get("ticker") or params.get("ticker", ""),
+            "strategy_mode": params.get("strategy_mode", ""),
+            "start_date": params.get("start_date", ""),
+            "end_date": params.get("end_date", ""),
+            "final_equity": summary.get("final_equity"),
+            "total_return": summary.get("total_return"),
+            "annual_return": summary.get("annual_return"),
+            "sharpe_ratio": summary.get("sharpe_ratio"),
+            "max_drawdown": summary.get("max_drawdown"),
+            "win_rate": summary.get("win_rate"),
+            "profit_factor": summary.get("profit_factor"),
+            "total_trades": summary.get("total_trades"),
+            "params": json.dumps(params, ensure_ascii=False),
+            "summary": json.dumps(summary, ensure_ascii=False),
+            "payload": zlib.compress(payload, 6),
+        }
+        cols = ", ".join(row)
+        marks = ", ".join(f":{k}" for k in row)
+        updates = ", ".join(f"{k} = excluded.{k}" for k in row if k != "request_hash")
+        cur = conn.execute(
+            f"INSERT INTO runs ({cols}) VALUES ({marks}) "
+            f"ON CONFLICT(request_hash) DO UPDATE SET {updates} RETURNING id",
+            row,
+        )
+        run_id = cur.fetchone()[0]
+        conn.commit()
+        return run_id
+
+    def query(self, ticker=None, strategy_mode=None, sort_by="created_at", order="desc", limit=50, offset=0):
+        """ 篩選 + 排序 + 分頁，回傳 (符合條件總筆數, 紀錄列表) """
+        if sort_by not in SORTABLE_COLUMNS:
+            raise ValueError(f"不支援的排序欄位: {sort_by}")
+        direction = "ASC" if str(order).lower() == "asc" else "DESC"
+
+        where = []
+        args = []
+        if ticker:
+            where.append("ticker = ?")
+            args.append(normalize_ticker(ticker))
+        if strategy_mode:
+            where.append("strategy_mode = ?")
+            args.append(strategy_mode)
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM runs {where_sql}", args).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {', '.join(LIST_COLUMNS)} FROM runs {where_sql} "
+            f"ORDER BY {sort_by} {direction}, id {direction} LIMIT ? OFFSET ?",
+            [*args, int(limit), int(offset)],
+        ).fetchall()
+
+        items = []
+        for row in rows:
+            item = dict(row)
+            item["params"] = json.loads(item["params"])
+            items.append(item)
+        return total, items
+
+    def get(self, run_id):
+        """ 取得單筆紀錄 (含解壓後的 payload)，不存在時回傳 None """
+        row = self._connect().execute(
+            "SELECT id, created_at, params, summary, payload FROM runs WHERE id = ?", (run_id,)
+        ).fetchone()
+        if row is None: return None
+        return {
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "params": json.loads(row["params"]),
+            "summary": json.loads(row["summary"]),
+            "payload": zlib.decompress(row["payload"]),
+        }
+
+
+_run_history = None
+_run_history_lock = threading.Lock()
+
+
+def get_run_history():
+    global _run_history
+    if _run_history is None:
+        with _run_history_lock:
+            if _run_history is None:
+                _run_history = RunHistory()
+    return _run_history
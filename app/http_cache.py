@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+
+from fastapi import Response
+from fastapi.staticfiles import StaticFiles
+
+try:
+    import brotli  # 選用套件: 有安裝時優先使用 br 壓縮
+except ImportError:
+    brotli = None
+
+# ==========================================
+#  條件式請求 (ETag / 304) 與回應壓縮
+# ==========================================
+# 回測結果體積大且同一組參數常被重複請求:
+# ETag 由 (請求雜湊, 數據版本, 表示格式) 決定，客戶端帶 If-None-Match 命中時直接回 304，
+# 不需重算也不需傳送內容；需要傳送時依 Accept-Encoding 以 br / gzip 壓縮。
+# SSE 串流不經過這裡 (壓縮會緩衝事件)，因此不使用全域的 GZipMiddleware。
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # 預設 11 壓縮率較高但慢上數十倍，不適合即時回應
+ENCODING_SUFFIXES = ("-br", "-gzip")
+VARY = "Accept, Accept-Encoding"
+
+# /static 中帶 ?v= 版本參數的資源內容不會改變，可長期快取；未帶版本者每次以 ETag 驗證
+STATIC_IMMUTABLE = "public, max-age=31536000, immutable"
+STATIC_REVALIDATE = "public, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """ 以各組成部分產生強 ETag (含引號) """
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _with_encoding(etag, encoding):
+    # 同一內容的不同壓縮版本需使用不同的強 ETag
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def match_etag(if_none_match, etag):
+    """
+    If-None-Match 是否命中 (弱比較，忽略 W/ 前綴與壓縮版本後綴)。
+    命中時回傳客戶端持有的 ETag (304 回應沿用)，否則回傳 None
+    """
+    if not if_none_match: return None
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*": return etag
+        if tag.startswith("W/"): tag = tag[2:]
+        base = tag
+        for suffix in ENCODING_SUFFIXES:
+            if tag.endswith(suffix + '"'):
+                base = tag[:-len(suffix) - 1] + '"'
+                break
+        if base == etag: return tag
+    return None
+
+
+def negotiate_encoding(accept_encoding) -> str:
+    """ 依 Accept-Encoding 選擇壓縮方式 (br > gzip)，不支援時回傳 None """
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        try:
+            if q.startswith("q=") and float(q[2:]) == 0: continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted: return "br"
+    if "gzip" in accepted: return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding) -> bytes:
+    if encoding == "br": return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip": return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
+
+
+def encode_body(body: bytes, accept_encoding):
+    """ 大於 COMPRESS_MIN_SIZE 時依客戶端支援壓縮，回傳 (內容, encoding) """
+    encoding = negotiate_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_SIZE else None
+    return compress_body(body, encoding), encoding
+
+
+def not_modified(etag) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Vary": VARY, "Cache-Control": "private, no-cache"})
+
+
+def cacheable_response(body: bytes, media_type, etag, encoding=None) -> Response:
+    """ 帶 ETag 的回應 (body 需已依 encoding 壓縮)；no-cache 讓瀏覽器保留副本但每次以 If-None-Match 驗證 """
+    headers = {"ETag": _with_encoding(etag, encoding), "Vary": VARY, "Cache-Control": "private, no-cache"}
+    if encoding: headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+class CachedStaticFiles(StaticFiles):
+    """ 為 /static 加上 Cache-Control (版本化資源長期快取) """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        query = scope.get("query_string", b"").decode("latin-1")
+        versioned = any(part.startswith("v=") for part in query.split("&"))
+        response.headers["Cache-Control"] = STATIC_IMMUTABLE if versioned else STATIC_REVALIDATE
+        return response
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import datetime as dt
+import hashlib
+import os
+import time
+from pathlib import Path
+
+from .cache import get_shared_cache
+
+# ==========================================
+#  批次行情匯入 (Bulk Ingestion)
+# ==========================================
+# 開盤前先把觀察清單的歷史行情批次抓好，寫入 data/*.csv 與共享快取，
+# 使用者回測時直接命中快取，不必逐檔即時下載。
+# pandas / yfinance 只在實際使用時才 import，維持 app.main 的快速啟動。
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+REQUIRED_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def normalize_ticker(ticker: str) -> str:
+    """ 統一代碼格式: 轉大寫，純數字 (台股) 自動補上 .TW """
+    ticker = ticker.upper().strip()
+    if ticker.isdigit() or (len(ticker) == 4 and ticker.isdigit()): ticker += ".TW"
+    return ticker
+
+
+def normalize_ohlcv(df):
+    """ 清洗下載的行情 (攤平欄位、去除時區、補值)，缺少必要欄位時回傳 None """
+    import pandas as pd
+
+    if df is None or df.empty: return None
+    df = df.copy()
+
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(0)
+
+    df.columns = [c if isinstance(c, str) else c[0] for c in df.columns]
+
+    if df.index.tz is not None: df.index = df.index.tz_localize(None)
+    if 'Adj Close' in df.columns and 'Close' not in df.columns: df.rename(columns={'Adj Close': 'Close'}, inplace=True)
+
+    if not all(col in df.columns for col in REQUIRED_COLUMNS): return None
+
+    return df.ffill().bfill()
+
+
+def data_version(df) -> str:
+    """ 行情數據的內容雜湊，數據更新 (重新下載 / 匯入) 後即改變 """
+    import pandas as pd
+
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()).hexdigest()[:16]
+
+
+def slice_version(version, start, end) -> str:
+    """ 匯入資料切片的版本: 由完整資料的版本與區間決定，不必重新雜湊切片 """
+    return hashlib.sha256(f"{version}|{start}|{end}".encode("utf-8")).hexdigest()[:16]
+
+
+# ------------------------------------------
+#  資料來源 (Provider)
+# ------------------------------------------
+class YahooProvider:
+    """ Yahoo Finance: 一次呼叫下載多檔股票 """
+
+    def download(self, tickers, start, end):
+        import yfinance as yf
+
+        df = yf.download(tickers, start=start, end=end, progress=False, auto_adjust=True,
+                         group_by='ticker', threads=False)
+        frames = {}
+        if df is None or df.empty: return frames
+        available = set(df.columns.get_level_values(0))
+        for ticker in tickers:
+            if ticker in available:
+                frames[ticker] = df[ticker].dropna(how='all')
+        return frames
+
+
+class CsvProvider:
+    """ 本機假資料來源: 從目錄中的 {ticker}.csv 讀取 (測試 / 壓力測試 / 離線使用) """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or DATA_DIR)
+
+    def download(self, tickers, start, end):
+        import pandas as pd
+
+        frames = {}
+        for ticker in tickers:
+            path = self.directory / f"{ticker}.csv"
+            if not path.exists(): continue
+            df = pd.read_csv(path, index_col=0, parse_dates=True)
+            frames[ticker] = df[(df.index >= start) & (df.index < end)]
+        return frames
+
+
+def get_provider(name=None, source_dir=None):
+    """ 依名稱 (或環境變數 BACKTEST_DATA_PROVIDER) 取得資料來源，預設為 yahoo """
+    name = (name or os.environ.get("BACKTEST_DATA_PROVIDER", "yahoo")).lower()
+    if name == "csv":
+        return CsvProvider(source_dir or os.environ.get("BACKTEST_CSV_SOURCE_DIR"))
+    if name == "yahoo":
+        return YahooProvider()
+    raise ValueError(f"未知的資料來源: {name}")
+
+
+# ------------------------------------------
+#  匯入流程
+# ------------------------------------------
+def store_ohlcv(ticker, df, start, end, data_dir=None, cache=None, write_csv=True):
+    """
+    寫入 CSV 與共享快取 (ohlcv_full: 記錄涵蓋區間，供任意子區間的回測直接切片)。
+    數據版本另存一筆 ohlcv_full_version，比對 ETag 時不必解開整段行情
+    """
+    if write_csv:
+        data_dir = Path(data_dir or DATA_DIR)
+        data_dir.mkdir(parents=True, exist_ok=True)
+        df.to_csv(data_dir / f"{ticker}.csv")
+    cache = cache or get_shared_cache()
+    version = data_version(df)
+    # 先寫版本: 覆寫期間讀到新版本、舊行情只會讓 ETag 不命中，不會誤回 304
+    cache.set("ohlcv_full_version", ticker, {"start": start, "end": end, "version": version})
+    cache.set("ohlcv_full", ticker, {"start": start, "end": end, "df": df, "version": version})
+
+
+def load_ingested(ticker, start, end, cache=None):
+    """ 若匯入的資料涵蓋 [start, end)，回傳 (切片後的行情, 數據版本)，否則回傳 None """
+    # 匯入資料由排程定期覆寫，不套用快取 TTL (否則前一晚匯入的資料開盤時已過期)
+    entry = (cache or get_shared_cache()).get("ohlcv_full", ticker, ttl=0)
+    if entry is None or entry["start"] > start or entry["end"] < end: return None
+    df = entry["df"]
+    df = df[(df.index >= start) & (df.index < end)]
+    if df.empty: return None
+    version = entry.get("version") or data_version(entry["df"])
+    return df, slice_version(version, start, end)
+
+
+def ingested_version(ticker, start, end, cache=None):
+    """ 只讀取匯入資料的版本 (不解開行情)；未涵蓋 [start, end) 時回傳 None """
+    entry = (cache or get_shared_cache()).get("ohlcv_full_version", ticker, ttl=0)
+    if entry is None or entry["start"] > start or entry["end"] < end: return None
+    return slice_version(entry["version"], start, end)
+
+
+async def ingest(tickers, start, end, provider=None, batch_size=20, max_concurrency=4,
+                 retries=3, backoff=1.0, data_dir=None, cache=None):
+    """
+    批次匯入: 每批一次呼叫 provider (多檔下載)，最多 max_concurrency 批同時進行，
+    整批失敗或部分代碼沒有數據時，以指數退避 (backoff * 2^n 秒) 重試失敗的部分。回傳 {"ingested": [...], "failed": {ticker: 原因}}
+    """
+    provider = provider or get_provider()
+    tickers = list(dict.fromkeys(normalize_ticker(t) for t in tickers if t.strip()))
+    batches = [tickers[i:i + batch_size] for i in range(0, len(tickers), batch_size)]
+
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    ingested = []
+    failed = {}
+
+    # csv 來源與輸出是同一個目錄時不回寫，否則來源檔會被覆蓋成 [start, end) 的切片
+    write_csv = not (isinstance(provider, CsvProvider)
+                     and provider.directory.resolve() == Path(data_dir or DATA_DIR).resolve())
+
+    async def run_batch(batch):
+        # yfinance 對個別代碼的失敗 (限流 / 逾時) 不會拋出例外，只是結果中少了該代碼，
+        # 因此缺少的代碼與整批失敗一樣以指數退避重試
+        pending = list(batch)
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    frames = await loop.run_in_executor(None, provider.download, pending, start, end)
+                except Exception as e:
+                    if attempt == retries:
+                        print(f"[Ingest] 批次失敗 {pending}: {e}")
+                        failed.update({t: str(e) for t in pending})
+                        return
+                    reason = e
+                else:
+                    missing = []
+                    for ticker in pending:
+                        df = normalize_ohlcv(frames.get(ticker))
+                        if df is None:
+                            missing.append(ticker)
+                            continue
+                        await loop.run_in_executor(
+                            None, store_ohlcv, ticker, df, start, end, data_dir, cache, write_csv)
+                        ingested.append(ticker)
+                    pending = missing
+                    if not pending: return
+                    if attempt == retries:
+                        failed.update({t: "找不到數據" for t in pending})
+                        return
+                    reason = f"缺少 {pending}"
+                delay = backoff * (2 ** attempt)
+                print(f"[Ingest] 批次失敗，{delay:.1f}s 後重試 ({attempt + 1}/{retries}): {reason}")
+                await asyncio.sleep(delay)
+
+    await asyncio.gather(*(run_batch(b) for b in batches))
+    return {"ingested": sorted(ingested), "failed": failed}
+
+
+def read_watchlist(path):
+    """ 觀察清單檔案: 每行一個代碼，# 開頭為註解 """
+    lines = Path(path).read_text(encoding="utf-8").splitlines()
+    return [line.split("#")[0].strip() for line in lines if line.split("#")[0].strip()]
+
+
+def main(argv=None):
+    today = dt.date.today()
+    parser = argparse.ArgumentParser(description="批次匯入觀察清單的歷史行情")
+    parser.add_argument("tickers", nargs="*", help="股票代碼 (純數字自動補 .TW)")
+    parser.add_argument("--watchlist", help="觀察清單檔案 (每行一個代碼)")
+    parser.add_argument("--from-data-dir", action="store_true", help="重新匯入 data/ 中既有的所有代碼")
+    parser.add_argument("--start", default=(today - dt.timedelta(days=365 * 10)).isoformat())
+    parser.add_argument("--end", default=(today + dt.timedelta(days=1)).isoformat(), help="不含當日 (與 yfinance 相同)")
+    parser.add_argument("--provider", default=None, help="yahoo (預設) 或 csv")
+    parser.add_argument("--source-dir", default=None, help="csv 資料來源的目錄")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    tickers = list(args.tickers)
+    if args.watchlist: tickers += read_watchlist(args.watchlist)
+    if args.from_data_dir: tickers += [p.stem for p in DATA_DIR.glob("*.csv")]
+    if not tickers:
+        parser.error("請提供代碼、--watchlist 或 --from-data-dir")
+
+    started = time.perf_counter()
+    result = asyncio.run(ingest(
+        tickers, args.start, args.end,
+        provider=get_provider(args.provider, args.source_dir),
+        batch_size=args.batch_size, max_concurrency=args.max_concurrency,
+        retries=args.retries, backoff=args.backoff,
+    ))
+    print(f"[Ingest] 完成 {len(result['ingested'])} 檔，失敗 {len(result['failed'])} 檔 "
+          f"({time.perf_counter() - started:.1f}s)")
+    for ticker, reason in result["failed"].items():
+        print(f"  - {ticker}: {reason}")
+    return 0 if not result["failed"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
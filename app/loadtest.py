@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import datetime as dt
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# ==========================================
+#  壓力測試 (Load Test)
+# ==========================================
+# 以 asyncio 模擬多位使用者同時呼叫 /api/backtest，量測吞吐量、延遲百分位與錯誤率，
+# 結果存成 JSON，方便比較不同版本的承載能力。
+# 預設會自行啟動一個使用本機 CSV 數據 (BACKTEST_DATA_PROVIDER=csv) 的伺服器，不會連到 Yahoo。
+#
+#   python -m app.loadtest --concurrency 16 --requests 400 --mix basic=6,advanced=3,periodic=1
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = ROOT_DIR / "data"
+RESULTS_DIR = DATA_DIR / "loadtest"
+
+DEFAULT_TICKERS = ["AAPL", "NVDA", "TSLA", "2303.TW", "006208.TW"]
+
+PAYLOAD_TEMPLATES = {
+    "basic": {
+        "strategy_mode": "basic",
+        "ma_short": 10, "ma_long": 60,
+        "stop_loss_pct": 5.0, "take_profit_pct": 20.0,
+    },
+    "advanced": {
+        "strategy_mode": "advanced",
+        "entry_strategy_1": "KD_GOLDEN", "entry_params_1": {"period": 9},
+        "entry_strategy_2": "TURTLE_ENTRY", "entry_params_2": {"period": 20},
+        "exit_strategy_1": "WILLR_OVERBOUGHT", "exit_params_1": {"period": 14},
+        "exit_strategy_2": "BB_UPPER", "exit_params_2": {"period": 20, "std": 2.0},
+    },
+    "periodic": {
+        "strategy_mode": "periodic",
+        "monthly_contribution_amount": 5000,
+        "monthly_contribution_days": [5, 20],
+    },
+}
+
+
+def parse_mix(text):
+    """ 解析請求比例，例如 "basic=6,advanced=3,periodic=1" """
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in PAYLOAD_TEMPLATES:
+            raise ValueError(f"未知的請求類型: {kind}")
+        mix[kind] = float(weight or 1)
+    if not any(w > 0 for w in mix.values()):
+        raise ValueError("請求比例必須至少有一項大於 0")
+    return mix
+
+
+def build_payload(kind, seq, rng, tickers, start, end, unique=True):
+    """ 依模板產生 BacktestRequest；unique 時以 cash 區分每筆請求，避免命中回測結果快取 """
+    payload = {"ticker": rng.choice(tickers), "start_date": start, "end_date": end}
+    payload.update(json.loads(json.dumps(PAYLOAD_TEMPLATES[kind])))
+    if unique:
+        payload["cash"] = 100000 + seq + 1
+    return payload
+
+
+def percentile(sorted_values, pct):
+    """ 線性內插的百分位數 (sorted_values 需已排序) """
+    if not sorted_values: return None
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+# ------------------------------------------
+#  HTTP 用戶端 (僅依賴標準庫)
+# ------------------------------------------
+async def http_request(host, port, method, path, body=None, timeout=60.0):
+    """ 送出一次 HTTP/1.1 請求 (Connection: close)，回傳 (狀態碼, 回應位元組數) """
+    data = json.dumps(body).encode() if body is not None else b""
+    head = (
+        f"{method} {path} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Content-Type: application/json\r\n"
+        "Accept: application/json\r\n"
+        f"Content-Length: {len(data)}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode()
+
+    async def exchange():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(head + data)
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        status_line, _, rest = response.partition(b"\r\n")
+        _, _, payload = rest.partition(b"\r\n\r\n")
+        return int(status_line.split()[1]), len(payload)
+
+    return await asyncio.wait_for(exchange(), timeout)
+
+
+async def wait_until_ready(host, port, timeout=60.0, process=None):
+    """ 輪詢 /api/ready 直到伺服器完成預熱 """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("伺服器啟動失敗")
+        try:
+            status, _ = await http_request(host, port, "GET", "/api/ready", timeout=2)
+            if status == 200: return
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError("等待伺服器就緒逾時")
+
+
+def start_server(port, workers, source_dir):
+    """ 啟動使用本機 CSV 數據、獨立快取與歷史紀錄的 uvicorn 伺服器，回傳 (Popen, 暫存目錄) """
+    tmpdir = tempfile.TemporaryDirectory(prefix="backtest-loadtest-")
+    env = dict(
+        os.environ,
+        BACKTEST_DATA_PROVIDER="csv",
+        BACKTEST_CSV_SOURCE_DIR=str(source_dir),
+        BACKTEST_CACHE_PATH=str(Path(tmpdir.name) / "cache.sqlite3"),
+        BACKTEST_HISTORY_PATH=str(Path(tmpdir.name) / "history.sqlite3"),
+    )
+    cmd = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ]
+    process = subprocess.Popen(cmd, cwd=ROOT_DIR, env=env)
+    return process, tmpdir
+
+
+# ------------------------------------------
+#  壓力測試流程
+# ------------------------------------------
+async def run_load(host, port, mix, concurrency=8, total_requests=200, duration=None,
+                   tickers=None, start="2023-01-01", end="2025-12-01", unique=True,
+                   timeout=60.0, seed=0):
+    """
+    以 concurrency 個虛擬使用者 (closed loop，收到回應才送下一筆) 持續送出請求，
+    直到達到 total_requests 筆或 duration 秒。回傳 (樣本列表, 實際耗時秒數)
+    """
+    rng = random.Random(seed)
+    tickers = tickers or DEFAULT_TICKERS
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    samples = []
+    counter = iter(range(10 ** 9))
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    async def user():
+        while True:
+            seq = next(counter)
+            if deadline is None and seq >= total_requests: return
+            if deadline is not None and time.perf_counter() >= deadline: return
+            kind = rng.choices(kinds, weights)[0]
+            payload = build_payload(kind, seq, rng, tickers, start, end, unique)
+            t0 = time.perf_counter()
+            try:
+                status, size = await http_request(host, port, "POST", "/api/backtest", payload, timeout)
+                error = None if status == 200 else f"HTTP {status}"
+            except Exception as e:
+                status, size, error = None, 0, f"{type(e).__name__}: {e}"
+            samples.append({
+                "kind": kind, "status": status, "bytes": size, "error": error,
+                "latency_ms": (time.perf_counter() - t0) * 1000,
+            })
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    """ 整體與各類型請求的吞吐量、延遲百分位與錯誤率 """
+    def stats(group):
+        latencies = sorted(s["latency_ms"] for s in group if s["error"] is None)
+        errors = sum(1 for s in group if s["error"] is not None)
+        return {
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": errors / len(group) if group else 0.0,
+            "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+            "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": latencies[-1] if latencies else None,
+        }
+
+    by_kind = {}
+    for s in samples:
+        by_kind.setdefault(s["kind"], []).append(s)
+    error_messages = {}
+    for s in samples:
+        if s["error"] is not None:
+            error_messages[s["error"]] = error_messages.get(s["error"], 0) + 1
+    return {
+        "elapsed_s": elapsed,
+        "overall": stats(samples),
+        "by_kind": {kind: stats(group) for kind, group in sorted(by_kind.items())},
+        "error_messages": error_messages,
+    }
+
+
+def version_info():
+    """ 專案版本與 git commit (若可取得)，用於跨版本比較 """
+    info = {"version": None, "git_commit": None}
+    try:
+        import tomllib
+        with open(ROOT_DIR / "pyproject.toml", "rb") as f:
+            info["version"] = tomllib.load(f)["project"]["version"]
+    except Exception:
+        pass
+    try:
+        info["git_commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except Exception:
+        pass
+    return info
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_report(report, previous=None):
+    print("=== 壓力測試結果 ===")
+    cfg = report["config"]
+    print(f"併發 {cfg['concurrency']}  比例 {cfg['mix']}  耗時 {report['summary']['elapsed_s']:.1f}s")
+    print(f"{'類型':<10}{'請求':>7}{'錯誤率':>9}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    rows = [("overall", report["summary"]["overall"]), *report["summary"]["by_kind"].items()]
+    for name, s in rows:
+        print(f"{name:<10}{s['requests']:>7}{s['error_rate'] * 100:>8.1f}%{s['throughput_rps']:>9.2f}"
+              f"{_fmt(s['p50_ms']):>9}{_fmt(s['p95_ms']):>9}{_fmt(s['p99_ms']):>9}{_fmt(s['max_ms']):>9}")
+    for message, count in report["summary"]["error_messages"].items():
+        print(f"  ! {message} x{count}")
+
+    if previous:
+        prev = previous["summary"]["overall"]
+        cur = report["summary"]["overall"]
+        print(f"--- 與 {previous.get('git_commit') or previous.get('timestamp')} 比較 ---")
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate"):
+            if prev.get(key) is None or cur.get(key) is None: continue
+            delta = (cur[key] - prev[key]) / prev[key] * 100 if prev[key] else 0.0
+            print(f"{key:<15}{prev[key]:>10.2f} -> {cur[key]:>10.2f} ({delta:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="/api/backtest 壓力測試")
+    parser.add_argument("--url", default=None, help="測試既有伺服器 (例如 http://127.0.0.1:8000)；未指定則自行啟動")
+    parser.add_argument("--port", type=int, default=8765, help="自行啟動伺服器時使用的端口")
+    parser.add_argument("--workers", type=int, default=1, help="自行啟動伺服器時的 worker 數")
+    parser.add_argument("--source-dir", default=str(DATA_DIR), help="本機 CSV 數據目錄")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時在線的虛擬使用者數")
+    parser.add_argument("--requests", type=int, default=200, help="總請求數")
+    parser.add_argument("--duration", type=float, default=None, help="改以秒數為準 (覆蓋 --requests)")
+    parser.add_argument("--warmup", type=int, default=3, help="正式量測前的暖身請求數 (不計入結果)")
+    parser.add_argument("--mix", default="basic=6,advanced=3,periodic=1")
+    parser.add_argument("--tickers", default=",".join(DEFAULT_TICKERS))
+    parser.add_argument("--start", default="2023-01-01")
+    parser.add_argument("--end", default="2025-12-01")
+    parser.add_argument("--allow-cache-hits", action="store_true", help="重複送出相同請求 (量測快取命中路徑)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help=f"結果 JSON 路徑 (預設 {RESULTS_DIR.relative_to(ROOT_DIR)}/<時間>.json)")
+    parser.add_argument("--compare", default=None, help="與先前的結果 JSON 比較")
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    tickers = [t.strip() for t in args.tickers.split(",") if t.strip()]
+    process = tmpdir = None
+    if args.url:
+        host_port = args.url.split("://", 1)[-1].rstrip("/")
+        host, _, port = host_port.partition(":")
+        port = int(port or 80)
+    else:
+        host, port = "127.0.0.1", args.port
+        process, tmpdir = start_server(port, args.workers, args.source_dir)
+
+    async def session():
+        await wait_until_ready(host, port, process=process)
+        if args.warmup:
+            await run_load(host, port, mix, concurrency=1, total_requests=args.warmup, tickers=tickers,
+                           start=args.start, end=args.end, unique=False, timeout=args.timeout, seed=args.seed)
+        return await run_load(
+            host, port, mix, concurrency=args.concurrency, total_requests=args.requests,
+            duration=args.duration, tickers=tickers, start=args.start, end=args.end,
+            unique=not args.allow_cache_hits, timeout=args.timeout, seed=args.seed + 1,
+        )
+
+    try:
+        samples, elapsed = asyncio.run(session())
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            tmpdir.cleanup()
+
+    timestamp = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
+    report = {
+        **version_info(),
+        "timestamp": timestamp,
+        "config": {
+            "url": args.url or f"http://{host}:{port}", "workers": None if args.url else args.workers,
+            "concurrency": args.concurrency, "requests": args.requests, "duration": args.duration,
+            "mix": mix, "tickers": tickers, "start": args.start, "end": args.end,
+            "cache_hits": args.allow_cache_hits, "cpu_count": os.cpu_count(),
+        },
+        "summary": summarize(samples, elapsed),
+    }
+
+    previous = None
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+    print_report(report, previous)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{timestamp}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"結果已儲存: {output}")
+    return 0 if report["summary"]["overall"]["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
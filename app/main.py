@@ -1,28 +1,78 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Request, Response, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from contextlib import asynccontextmanager
 from pathlib import Path
-from backtesting import Backtest
-import pandas as pd
-import yfinance as yf
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache
+from functools import lru_cache, partial
 import traceback
-import numpy as np
+import hashlib
+import hmac
+import json
+import struct
+import threading
 import math
 import os
-
-if not hasattr(pd.Series, 'iteritems'):
-    pd.Series.iteritems = pd.Series.items
-if not hasattr(np, 'float'):
-    np.float = float
-
-from .strategy import UniversalStrategy
-from .schemas import BacktestRequest, BacktestResponse
-
-app = FastAPI()
+import time
+
+from .schemas import (
+    BacktestRequest, BacktestResponse, HistoryListResponse, IngestRequest, IngestResponse,
+    DcaMatrixRequest, DcaMatrixResponse,
+)
+from .cache import get_shared_cache
+from .history import get_run_history, SORTABLE_COLUMNS
+from .ingest import (
+    normalize_ticker, normalize_ohlcv, data_version, load_ingested, ingested_version, ingest, get_provider,
+)
+from .timeframe import normalize_timeframe, get_resampled, aggregate_to_bars
+from .http_cache import CachedStaticFiles, make_etag, match_etag, encode_body, not_modified, cacheable_response
+
+# ==========================================
+#  延遲載入重量級模組
+# ==========================================
+# pandas / numpy / backtesting / yfinance 合計佔冷啟動大半時間，
+# 改為第一次使用時才載入；伺服器開始監聽後也會在背景執行緒預熱。
+pd = np = yf = Backtest = UniversalStrategy = contribution_schedule = dca_matrix = None
+_heavy_lock = threading.Lock()
+_heavy_ready = threading.Event()
+
+def load_heavy_modules():
+    """ 載入並初始化重量級模組 (可重複呼叫，只會執行一次) """
+    global pd, np, yf, Backtest, UniversalStrategy, contribution_schedule, dca_matrix
+    if _heavy_ready.is_set(): return
+    with _heavy_lock:
+        if _heavy_ready.is_set(): return
+        started = time.perf_counter()
+
+        import pandas
+        import numpy
+        if not hasattr(pandas.Series, 'iteritems'):
+            pandas.Series.iteritems = pandas.Series.items
+        if not hasattr(numpy, 'float'):
+            numpy.float = float
+        import yfinance
+        from backtesting import Backtest as _Backtest
+        from .strategy import UniversalStrategy as _UniversalStrategy, contribution_schedule as _contribution_schedule, dca_matrix as _dca_matrix
+
+        pd, np, yf = pandas, numpy, yfinance
+        Backtest, UniversalStrategy = _Backtest, _UniversalStrategy
+        contribution_schedule, dca_matrix = _contribution_schedule, _dca_matrix
+        _heavy_ready.set()
+        print(f"[Startup] 重量級模組載入完成 ({time.perf_counter() - started:.2f}s)")
+
+async def ensure_heavy_modules():
+    """ 在 executor 中載入，避免第一個請求卡住 event loop """
+    if not _heavy_ready.is_set():
+        await asyncio.get_event_loop().run_in_executor(None, load_heavy_modules)
+
+@asynccontextmanager
+async def lifespan(app):
+    # 不等待預熱完成，讓伺服器先開始監聽；就緒狀態由 /api/ready 回報
+    threading.Thread(target=load_heavy_modules, daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # 設定路徑
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -32,8 +82,17 @@ DATA_DIR = BASE_DIR / "data"
 
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+_templates = None
+
+def get_templates():
+    """ Jinja2 僅首頁使用，延遲到第一次渲染時才載入 """
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+    return _templates
+
+app.mount("/static", CachedStaticFiles(directory=str(STATIC_DIR)), name="static")
 
 def safe_num(value, decimal=2):
     try:
@@ -57,39 +116,77 @@ def _download_from_yahoo(ticker: str, start: str, end: str):
     except Exception:
         return pd.DataFrame()
 
+def use_local_provider():
+    """ BACKTEST_DATA_PROVIDER=csv 時改從本機 CSV 取數據 (壓力測試 / 離線使用) """
+    return os.environ.get("BACKTEST_DATA_PROVIDER", "yahoo").lower() == "csv"
+
+def _download_ohlcv(ticker: str, start: str, end: str):
+    if use_local_provider():
+        return get_provider("csv").download([ticker], start, end).get(ticker)
+    return _download_from_yahoo(ticker, start, end)
+
 async def get_yfinance_data(ticker: str, start: str, end: str):
-    ticker = ticker.upper().strip()
-    if ticker.isdigit() or (len(ticker) == 4 and ticker.isdigit()): ticker += ".TW"
+    """ 回傳 (行情, 代碼, 數據版本)；版本在寫入快取時算好並另存一筆 ohlcv_version，之後不必重新雜湊 """
+    ticker = normalize_ticker(ticker)
     
     loop = asyncio.get_event_loop()
-    try:
-        df = await loop.run_in_executor(None, _download_from_yahoo, ticker, start, end)
-        if df is None or df.empty: return None, ticker
-        
-        if isinstance(df.columns, pd.MultiIndex): 
-            df.columns = df.columns.get_level_values(0)
-        
-        df.columns = [c if isinstance(c, str) else c[0] for c in df.columns]
 
-        if df.index.tz is not None: df.index = df.index.tz_localize(None)
-        if 'Adj Close' in df.columns and 'Close' not in df.columns: df.rename(columns={'Adj Close': 'Close'}, inplace=True)
-        
-        required = ['Open', 'High', 'Low', 'Close', 'Volume']
-        if not all(col in df.columns for col in required): return None, ticker
-        
-        df = df.ffill().bfill()
+    # 先查跨進程共享快取，其他 worker 已下載過就不必再打 Yahoo
+    cache = get_shared_cache()
+    cache_key = f"{ticker}|{start}|{end}"
+    cached = await loop.run_in_executor(None, cache.get, "ohlcv", cache_key)
+    if cached is not None:
+        version = await loop.run_in_executor(None, cache.get, "ohlcv_version", cache_key)
+        if version is None:
+            version = await loop.run_in_executor(None, data_version, cached)
+            await loop.run_in_executor(None, cache.set, "ohlcv_version", cache_key, version)
+        return cached, ticker, version
+
+    # 批次匯入 (app.ingest) 的完整區間若涵蓋本次請求，直接切片使用
+    ingested = await loop.run_in_executor(None, load_ingested, ticker, start, end, cache)
+    if ingested is not None:
+        df, version = ingested
+        return df, ticker, version
+
+    try:
+        df = await loop.run_in_executor(None, _download_ohlcv, ticker, start, end)
+        df = normalize_ohlcv(df)
+        if df is None: return None, ticker, None
         
-        csv_path = DATA_DIR / f"{ticker}.csv"
-        df.to_csv(csv_path)
+        # 本機來源本身就是 CSV，不回寫以免覆蓋成區間切片
+        if not use_local_provider():
+            csv_path = DATA_DIR / f"{ticker}.csv"
+            df.to_csv(csv_path)
+        # 版本先寫入: 兩筆同時過期或被淘汰時，版本不會比行情活得久
+        version = await loop.run_in_executor(None, data_version, df)
+        await loop.run_in_executor(None, cache.set, "ohlcv_version", cache_key, version)
+        await loop.run_in_executor(None, cache.set, "ohlcv", cache_key, df)
         
-        return df, ticker
+        return df, ticker, version
     except Exception as e:
         print(f"數據處理錯誤: {e}")
-        return None, ticker
+        return None, ticker, None
+
+async def peek_data_version(ticker: str, start: str, end: str):
+    """ 只讀取快取中的數據版本 (不解開行情、不重新雜湊)；沒有快取時回傳 None """
+    ticker = normalize_ticker(ticker)
+    loop = asyncio.get_event_loop()
+    cache = get_shared_cache()
+    version = await loop.run_in_executor(None, cache.get, "ohlcv_version", f"{ticker}|{start}|{end}")
+    if version is None:
+        version = await loop.run_in_executor(None, ingested_version, ticker, start, end, cache)
+    return version
 
 @app.get("/")
 def read_root(request: Request):
-    return templates.TemplateResponse("dashboard.html", {"request": request})
+    return get_templates().TemplateResponse("dashboard.html", {"request": request})
+
+@app.get("/api/ready")
+def readiness():
+    """ 就緒檢查: 重量級模組預熱完成前回傳 503 (供 run.py 與負載平衡器輪詢) """
+    if not _heavy_ready.is_set():
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True}
 
 def get_indicator_note(strategy, strat_name, strat_params, idx):
     if not strat_name: return ""
@@ -165,6 +262,23 @@ def get_indicator_note(strategy, strat_name, strat_params, idx):
     return strat_name
 
 
+@app.post("/api/admin/ingest", response_model=IngestResponse)
+async def admin_ingest(params: IngestRequest, request: Request):
+    """ 批次匯入觀察清單行情 (需設定 BACKTEST_ADMIN_TOKEN 並附上相同的 X-Admin-Token 標頭) """
+    token = os.environ.get("BACKTEST_ADMIN_TOKEN")
+    supplied = request.headers.get("x-admin-token", "")
+    if not token or not hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="權限不足")
+    await ensure_heavy_modules()
+    try:
+        provider = get_provider(params.provider)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await ingest(
+        params.tickers, params.start_date, params.end_date, provider=provider,
+        batch_size=params.batch_size, max_concurrency=params.max_concurrency, retries=params.retries,
+    )
+
 @app.post("/api/shutdown")
 def shutdown_event():
     import os
@@ -195,9 +309,24 @@ def shutdown_event():
     threading.Thread(target=kill).start()
     return {"message": "系統正在關閉..."}
 
-@app.post("/api/backtest", response_model=BacktestResponse)
-async def run_backtest(params: BacktestRequest):
-    df, real_ticker = await get_yfinance_data(params.ticker, params.start_date, params.end_date)
+# 計算結果的版本: 修改策略、_compute_backtest、dca_matrix 或回應格式而使輸出改變時必須遞增，
+# 共享快取中的舊結果與客戶端持有的 ETag 才會一併失效
+RESULT_VERSION = 1
+
+def request_hash(params: BacktestRequest) -> str:
+    """ 回測請求的穩定雜湊 (作為共享快取的 key) """
+    return hashlib.sha256(params.model_dump_json().encode("utf-8")).hexdigest()
+
+def result_cache_key(result_key: str, version: str) -> str:
+    """ 結果快取的 key: (結果版本, 請求雜湊, 數據版本) """
+    return f"v{RESULT_VERSION}|{result_key}|{version}"
+
+def result_etag(result_key: str, version: str, representation: str) -> str:
+    return make_etag(RESULT_VERSION, result_key, version, representation)
+
+async def load_backtest_data(params: BacktestRequest):
+    """ 下載並檢查回測所需數據，回傳 (行情, 代碼, 數據版本)；數據不足時直接拋出 HTTPException """
+    df, real_ticker, version = await get_yfinance_data(params.ticker, params.start_date, params.end_date)
     
     if df is None or df.empty:
         raise HTTPException(status_code=404, detail="找不到數據")
@@ -214,6 +343,235 @@ async def run_backtest(params: BacktestRequest):
     if len(df) < min_bars:
         raise HTTPException(status_code=400, detail=f"有效數據不足 {min_bars} 筆 (含空值)")
 
+    return df, real_ticker, version
+
+async def early_not_modified(request: Request, params, result_key: str, representation: str):
+    """ If-None-Match 與快取中的數據版本相符時直接回 304，不必載入行情；否則回傳 None """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match: return None
+    version = await peek_data_version(params.ticker, params.start_date, params.end_date)
+    if version is None: return None
+    matched = match_etag(if_none_match, result_etag(result_key, version, representation))
+    return not_modified(matched) if matched else None
+
+async def load_timeframes(params: BacktestRequest, df: "pd.DataFrame", real_ticker: str, version: str):
+    """ 依 timeframe / indicator_timeframe 由日 K 合成 (交易 K 棒, 指標 K 棒)；指標週期與交易週期相同時後者為 None """
+    loop = asyncio.get_event_loop()
+    timeframe = normalize_timeframe(params.timeframe)
+    bars = await loop.run_in_executor(None, get_resampled, df, real_ticker, timeframe, version)
+
+    min_bars = 12
+    if len(bars) < min_bars:
+        raise HTTPException(status_code=400, detail=f"{timeframe} 週期的 K 棒不足 {min_bars} 根，請拉長回測區間")
+
+    indicator_bars = None
+    if params.indicator_timeframe and normalize_timeframe(params.indicator_timeframe) != timeframe:
+        indicator_bars = await loop.run_in_executor(
+            None, get_resampled, df, real_ticker, params.indicator_timeframe, version)
+    return bars, indicator_bars
+
+BINARY_MEDIA_TYPE = "application/x-backtest-f64"
+
+def render_json_body(result) -> bytes:
+    """ /api/backtest 的 JSON 回應內容 (與 FastAPI 預設的 JSONResponse 序列化方式相同) """
+    payload = jsonable_encoder(BacktestResponse(**render_json_result(result)))
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+@app.post("/api/backtest", response_model=BacktestResponse)
+async def run_backtest(params: BacktestRequest, request: Request):
+    """
+    Accept 含 BINARY_MEDIA_TYPE 時，曲線以 float64 二進位格式回傳，其餘情況回傳 JSON。
+    ETag 由請求雜湊、數據版本與格式組成；If-None-Match 命中時回 304，不重算也不傳送內容。
+    """
+    await ensure_heavy_modules()
+    loop = asyncio.get_event_loop()
+    cache = get_shared_cache()
+    result_key = request_hash(params)
+    binary = BINARY_MEDIA_TYPE in request.headers.get("accept", "")
+    representation = "binary" if binary else "json"
+    early = await early_not_modified(request, params, result_key, representation)
+    if early is not None:
+        return early
+
+    df, real_ticker, version = await load_backtest_data(params)
+    etag = result_etag(result_key, version, representation)
+    matched = match_etag(request.headers.get("if-none-match"), etag)
+    if matched:
+        return not_modified(matched)
+
+    # 快取 key 含數據版本，行情更新後不會取到舊數據算出的結果
+    cache_key = result_cache_key(result_key, version)
+    result = await loop.run_in_executor(None, cache.get, "backtest", cache_key)
+
+    if result is None:
+        bars, indicator_bars = await load_timeframes(params, df, real_ticker, version)
+        # 回測為 CPU 密集運算，丟到 executor 避免阻塞 event loop
+        result = await loop.run_in_executor(
+            None, partial(_compute_backtest, params, bars, real_ticker,
+                          indicator_df=indicator_bars, daily_index=df.index))
+        await loop.run_in_executor(None, cache.set, "backtest", cache_key, result)
+        await loop.run_in_executor(None, record_history, params, result_key, result)
+
+    render = render_binary_result if binary else render_json_body
+    body = await loop.run_in_executor(None, render, result)
+    body, encoding = await loop.run_in_executor(None, encode_body, body, request.headers.get("accept-encoding"))
+    return cacheable_response(body, BINARY_MEDIA_TYPE if binary else "application/json", etag, encoding)
+
+@app.post("/api/dca/matrix", response_model=DcaMatrixResponse)
+async def run_dca_matrix(params: DcaMatrixRequest, request: Request):
+    """
+    定期定額比較矩陣: 扣款日 (預設 1~28 日) x 金額 x 手續費 一次算完，
+    規則與 periodic 模式相同，但不逐格執行 backtesting.py。同樣支援 ETag / 304 與壓縮。
+    """
+    await ensure_heavy_modules()
+    loop = asyncio.get_event_loop()
+    cache = get_shared_cache()
+    result_key = request_hash(params)
+    early = await early_not_modified(request, params, result_key, "dca")
+    if early is not None:
+        return early
+
+    df, real_ticker, version = await load_backtest_data(params)
+    etag = result_etag(result_key, version, "dca")
+    matched = match_etag(request.headers.get("if-none-match"), etag)
+    if matched:
+        return not_modified(matched)
+
+    cache_key = result_cache_key(result_key, version)
+    result = await loop.run_in_executor(None, cache.get, "dca", cache_key)
+    if result is None:
+        result = await loop.run_in_executor(None, _compute_dca_matrix, params, df, real_ticker)
+        await loop.run_in_executor(None, cache.set, "dca", cache_key, result)
+
+    body = json.dumps(result, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    body, encoding = await loop.run_in_executor(None, encode_body, body, request.headers.get("accept-encoding"))
+    return cacheable_response(body, "application/json", etag, encoding)
+
+def _compute_dca_matrix(params: DcaMatrixRequest, df: "pd.DataFrame", real_ticker: str):
+    days = sorted(set(params.days))
+    matrix = dca_matrix(df.index, df['Close'].to_numpy(dtype=float), params.cash, days, params.amounts, params.fees)
+    final_equity = np.nan_to_num(matrix["final_equity"])
+    annual_return = np.nan_to_num(matrix["annual_return"])
+
+    d, a, f = np.unravel_index(np.argmax(annual_return), annual_return.shape)
+    return {
+        "ticker": real_ticker,
+        "days": days,
+        "amounts": list(params.amounts),
+        "fees": list(params.fees),
+        "final_equity": np.round(final_equity, 0).tolist(),
+        "invested": np.round(matrix["invested"], 2).tolist(),
+        "annual_return": np.round(annual_return, 2).tolist(),
+        "best": {
+            "day": days[d],
+            "amount": params.amounts[a],
+            "fee": params.fees[f],
+            "final_equity": safe_num(final_equity[d, a, f], 0),
+            "annual_return": safe_num(annual_return[d, a, f]),
+        },
+    }
+
+class BacktestCancelled(Exception):
+    """ 客戶端中斷串流連線時，用來提早結束回測執行緒 """
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/backtest/stream")
+async def run_backtest_stream(params: BacktestRequest, include_result: bool = True):
+    """
+    以 Server-Sent Events 串流回測進度:
+    progress (已處理 K 棒數) -> summary (績效摘要) -> result (完整結果，格式同 /api/backtest) -> done
+    include_result=false 時不送 result，客戶端可改向 /api/backtest 取二進位結果 (已寫入共享快取)。
+    客戶端斷線時會中止回測，釋放 CPU。
+    """
+    await ensure_heavy_modules()
+    loop = asyncio.get_event_loop()
+    cache = get_shared_cache()
+    # 數據錯誤在開始串流前回報，維持與 /api/backtest 相同的狀態碼
+    df, real_ticker, version = await load_backtest_data(params)
+    result_key = request_hash(params)
+    cache_key = result_cache_key(result_key, version)
+    cached = await loop.run_in_executor(None, cache.get, "backtest", cache_key)
+    if cached is None:
+        daily_index = df.index
+        df, indicator_bars = await load_timeframes(params, df, real_ticker, version)
+
+    async def event_stream():
+        if cached is not None:
+            yield _sse("summary", _summary_fields(cached))
+            if include_result:
+                yield _sse("result", jsonable_encoder(BacktestResponse(**render_json_result(cached))))
+            yield _sse("done", {})
+            return
+
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+        runs_total = 1
+
+        def emit(event, data):
+            loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+        def on_progress(bars, total):
+            # 在回測執行緒中被呼叫，客戶端已離開就拋出例外中止 bt.run
+            if cancelled.is_set():
+                raise BacktestCancelled()
+            step = max(total // 50, 1)
+            if bars % step == 0 or bars == total:
+                emit("progress", {"bars": bars, "total_bars": total, "runs_completed": 0, "runs_total": runs_total})
+
+        def on_summary(summary):
+            emit("progress", {"bars": len(df), "total_bars": len(df), "runs_completed": runs_total, "runs_total": runs_total})
+            emit("summary", summary)
+
+        def on_done(f):
+            # 先取出例外，避免客戶端已離開時出現 "exception was never retrieved"
+            if not f.cancelled(): f.exception()
+            emit("done", None)
+
+        future = loop.run_in_executor(
+            None, partial(_compute_backtest, params, df, real_ticker, on_progress, on_summary, indicator_bars, daily_index))
+        future.add_done_callback(on_done)
+
+        try:
+            while True:
+                event, data = await queue.get()
+                if event == "done":
+                    break
+                yield _sse(event, data)
+
+            if future.exception() is not None:
+                exc = future.exception()
+                print(f"[Stream Error] {exc}")
+                yield _sse("error", {"detail": f"Server Error: {exc}"})
+                return
+
+            result = future.result()
+            await loop.run_in_executor(None, cache.set, "backtest", cache_key, result)
+            await loop.run_in_executor(None, record_history, params, result_key, result)
+            if include_result:
+                yield _sse("result", jsonable_encoder(BacktestResponse(**render_json_result(result))))
+            yield _sse("done", {})
+        finally:
+            # 客戶端斷線時 Starlette 會取消此 generator，通知回測執行緒停止
+            cancelled.set()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+SUMMARY_FIELDS = [
+    "ticker", "final_equity", "total_invested", "total_return", "annual_return", "buy_and_hold_return",
+    "win_rate", "winning_trades", "profit_factor", "total_trades", "avg_pnl", "max_consecutive_loss",
+    "max_drawdown", "sharpe_ratio",
+]
+
+def _summary_fields(result):
+    return {k: result[k] for k in SUMMARY_FIELDS if k in result}
+
+def _execute_backtest(params: BacktestRequest, df: "pd.DataFrame", progress_callback=None, contribution_counts=None, indicator_df=None):
     # 計算手續費率 (Backtesting 僅支援單一費率，故取平均)
     # 若為定期定額模式，因我們將在 Strategy 中手動扣除定額手續費，故將 Backtest 手續費設為 0
     if params.strategy_mode == 'periodic':
@@ -241,7 +599,10 @@ async def run_backtest(params: BacktestRequest):
         'monthly_contribution_amount': params.monthly_contribution_amount,
         'monthly_contribution_fee': params.monthly_contribution_fee,
         'monthly_contribution_days': params.monthly_contribution_days,
-        'commission_rate': commission_rate_param 
+        'contribution_counts': contribution_counts,
+        'commission_rate': commission_rate_param,
+        'progress_callback': progress_callback,
+        'indicator_data': indicator_df
     }
 
     if params.strategy_mode == 'basic':
@@ -269,51 +630,78 @@ async def run_backtest(params: BacktestRequest):
 
 
     
-    stats = bt.run(**strat_kwargs)
+    return bt.run(**strat_kwargs)
+
+def _compute_backtest(params: BacktestRequest, df: "pd.DataFrame", real_ticker: str, progress_callback=None, summary_callback=None, indicator_df=None, daily_index=None):
+    """
+    執行回測並整理成 API 回傳格式；summary_callback 會在繪圖數據整理前先收到績效摘要。
+    df 為交易週期的 K 棒；indicator_df 提供時，指標以該週期計算後對齊回 df (見 app.timeframe)。
+    daily_index 為合成前的日 K 時間軸，定期定額排程以它計算
+    """
+    # 定期定額排程只算一次: 每棒入金次數交給策略，累積投入資金用於 ROI。
+    # 高週期 K 棒的標籤只有各區間最後一天，直接排程會漏掉沒有「日期 >= 扣款日」標籤的月份，
+    # 因此先在日 K 上排程，再加總到各根 K 棒
+    schedule_index = df.index if daily_index is None else daily_index
+    contribution_counts, _ = contribution_schedule(
+        schedule_index, params.monthly_contribution_days, params.monthly_contribution_amount)
+    if daily_index is not None:
+        contribution_counts = aggregate_to_bars(contribution_counts, daily_index, params.timeframe)
+    invested_series = params.cash + np.cumsum(contribution_counts) * params.monthly_contribution_amount
+    stats = _execute_backtest(params, df, progress_callback, contribution_counts, indicator_df)
 
     # --- 修正報酬率計算 (針對定期定額) & 產生 ROI 曲線 ---
-    invested_series = []
-    current_invested = params.cash
-    
-    if params.monthly_contribution_amount > 0 and params.monthly_contribution_days:
-        last_m = -1
-        dep_set = set()
-        for ts in df.index:
-            m = ts.month
-            d = ts.day
-            if m != last_m:
-                dep_set = set()
-                last_m = m
-            
-            for t_day in params.monthly_contribution_days:
-                if d >= t_day and t_day not in dep_set:
-                    current_invested += params.monthly_contribution_amount
-                    dep_set.add(t_day)
-            
-            invested_series.append(current_invested)
-    else:
-        invested_series = [params.cash] * len(df)
-    
-    total_invested = invested_series[-1] if invested_series else params.cash
+    total_invested = invested_series[-1] if len(invested_series) else params.cash
     final_equity = stats["Equity Final [$]"]
     
     # 重新計算總報酬率
     adjusted_return = ((final_equity - total_invested) / total_invested) * 100
     
     equity_curve = stats._equity_curve
+    trades_df = stats._trades
+
+    # 計算獲利交易次數
+    winning_trades = len(trades_df[trades_df['PnL'] > 0]) if not trades_df.empty else 0
+
+    # 計算最大連續虧損次數
+    max_consecutive_loss = 0
+    current_loss = 0
+    for pnl in trades_df['PnL']:
+        if pnl < 0:
+            current_loss += 1
+            max_consecutive_loss = max(max_consecutive_loss, current_loss)
+        else:
+            current_loss = 0
+
+    summary = {
+        "ticker": real_ticker,
+        "final_equity": safe_num(stats["Equity Final [$]"], 0),
+        "total_invested": safe_num(total_invested), 
+        "total_return": safe_num(adjusted_return),
+        "annual_return": safe_num(stats["Return (Ann.) [%]"]),
+        "buy_and_hold_return": safe_num(stats["Buy & Hold Return [%]"]), 
+        "win_rate": safe_num(stats["Win Rate [%]"]),
+        "winning_trades": winning_trades,
+        "profit_factor": safe_num(stats.get("Profit Factor", 0)),
+        "total_trades": int(stats["# Trades"]),
+        "avg_pnl": safe_num(trades_df['PnL'].mean(), 0) if not trades_df.empty else 0,
+        "max_consecutive_loss": max_consecutive_loss,
+        "max_drawdown": safe_num(stats["Max. Drawdown [%]"]),
+        "sharpe_ratio": safe_num(stats["Sharpe Ratio"]),
+    }
+    # 串流模式下先送出績效摘要，曲線與交易明細稍後才整理完成
+    if summary_callback is not None:
+        summary_callback(summary)
+
+    # 曲線一律保留為 numpy 陣列 (共用同一條日期軸)，回傳時再依 Accept 轉成 JSON 或二進位
+    equity_vals = equity_curve['Equity'].to_numpy(dtype=float)
 
     # 準備 ROI 曲線數據 (時間序列)
-    roi_list = []
     if not equity_curve.empty and len(equity_curve) == len(invested_series):
-        roi_vals = (equity_curve['Equity'] - invested_series) / invested_series * 100
-        roi_list = [{"time": t.strftime("%Y-%m-%d"), "value": safe_num(v)} for t, v in zip(equity_curve.index, roi_vals)]
+        roi_vals = (equity_vals - invested_series) / invested_series * 100
     else:
-        roi_list = [{"time": t.strftime("%Y-%m-%d"), "value": safe_num((v - params.cash)/params.cash*100)} for t, v in zip(equity_curve.index, equity_curve['Equity'])]
+        roi_vals = (equity_vals - params.cash) / params.cash * 100
 
-    equity_list = [{"time": t.strftime("%Y-%m-%d"), "value": safe_num(v)} for t, v in zip(equity_curve.index, equity_curve['Equity'])]
-    
     # B&H Logic...
-    trades_df = stats._trades
     strategy = stats._strategy
 
     extra_trades = []
@@ -327,16 +715,9 @@ async def run_backtest(params: BacktestRequest):
                 "pnl": 0
             })
             
-    # 計算獲利交易次數
-    winning_trades = len(trades_df[trades_df['PnL'] > 0]) if not trades_df.empty else 0
-
     # 計算水下曲線
-    drawdown_list = []
-    if not equity_curve.empty:
-        equity_series = equity_curve['Equity']
-        running_max = equity_series.cummax()
-        drawdown_series = (equity_series - running_max) / running_max * 100
-        drawdown_list = [{"time": t.strftime("%Y-%m-%d"), "value": safe_num(v)} for t, v in zip(drawdown_series.index, drawdown_series)]
+    running_max = np.maximum.accumulate(equity_vals) if len(equity_vals) else equity_vals
+    drawdown_vals = (equity_vals - running_max) / running_max * 100
 
     # 計算損益分佈直方圖 (PnL Histogram)
     pnl_hist_data = {"labels": [], "values": [], "colors": []}
@@ -356,21 +737,13 @@ async def run_backtest(params: BacktestRequest):
                 pnl_hist_data["colors"].append(color)
 
     # 準備 B&H 曲線
-    bh_list = []
-    if len(df) > 0:
-        first = df['Close'].iloc[0]
-        if first > 0:
-            bh_vals = (df['Close'] / first) * params.cash
-            bh_list = [{"time": t.strftime("%Y-%m-%d"), "value": safe_num(v)} for t, v in zip(bh_vals.index, bh_vals)]
-            
-    equity_list = [{"time": t.strftime("%Y-%m-%d"), "value": safe_num(v)} for t, v in zip(equity_curve.index, equity_curve['Equity'])]
-    price_list = [{"time": t.strftime("%Y-%m-%d"), "value": safe_num(v)} for t, v in zip(df.index, df['Close'])]
-    
+    close_vals = df['Close'].to_numpy(dtype=float)
+    bh_vals = np.empty(0)
+    if len(close_vals) > 0 and close_vals[0] > 0:
+        bh_vals = close_vals / close_vals[0] * params.cash
+
     detailed_trades = []
     chart_trades = []
-    
-    max_consecutive_loss = 0
-    current_loss = 0
 
     if not trades_df.empty:
         for i, row in trades_df.iterrows():
@@ -428,12 +801,6 @@ async def run_backtest(params: BacktestRequest):
             chart_trades.append({"time": row['EntryTime'].strftime("%Y-%m-%d"), "price": safe_num(row['EntryPrice']), "type": "buy"})
             chart_trades.append({"time": row['ExitTime'].strftime("%Y-%m-%d"), "price": safe_num(row['ExitPrice']), "type": "sell"})
 
-            if row['PnL'] < 0:
-                current_loss += 1
-                max_consecutive_loss = max(max_consecutive_loss, current_loss)
-            else:
-                current_loss = 0
-
     if extra_trades:
         chart_trades.extend(extra_trades)
         
@@ -464,30 +831,123 @@ async def run_backtest(params: BacktestRequest):
                 heatmap_data[date.year][date.month] = safe_num(row['Return'])
 
 
-    lump_sum_bh_return_pct = stats["Buy & Hold Return [%]"]
-
     return {
-        "ticker": real_ticker,
-        "final_equity": safe_num(stats["Equity Final [$]"], 0),
-        "total_invested": safe_num(total_invested), 
-        "total_return": safe_num(adjusted_return),
-        "annual_return": safe_num(stats["Return (Ann.) [%]"]),
-        "buy_and_hold_return": safe_num(lump_sum_bh_return_pct), 
-        "win_rate": safe_num(stats["Win Rate [%]"]),
-        "winning_trades": winning_trades,
-        "profit_factor": safe_num(stats.get("Profit Factor", 0)),
-        "total_trades": int(stats["# Trades"]),
-        "avg_pnl": safe_num(trades_df['PnL'].mean(), 0) if not trades_df.empty else 0,
-        "max_consecutive_loss": max_consecutive_loss,
-        "max_drawdown": safe_num(stats["Max. Drawdown [%]"]),
-        "sharpe_ratio": safe_num(stats["Sharpe Ratio"]),
-        "equity_curve": equity_list,
-        "roi_curve": roi_list,
-        "drawdown_curve": drawdown_list,
+        **summary,
+        "curves": {
+            "dates": df.index.strftime("%Y-%m-%d").tolist(),
+            "equity": equity_vals,
+            "roi": roi_vals,
+            "drawdown": drawdown_vals,
+            "price": close_vals,
+            "buy_and_hold": bh_vals,
+        },
         "pnl_histogram": pnl_hist_data,  
-        "price_data": price_list,
         "trades": chart_trades,
         "heatmap_data": heatmap_data,
-        "buy_and_hold_curve": bh_list,
         "detailed_trades": detailed_trades
-    }
\ No newline at end of file
+    }
+
+# JSON 回應欄位 -> 內部曲線名稱
+CURVE_FIELDS = {
+    "equity_curve": "equity",
+    "roi_curve": "roi",
+    "drawdown_curve": "drawdown",
+    "price_data": "price",
+    "buy_and_hold_curve": "buy_and_hold",
+}
+
+def render_json_result(result):
+    """ 將內部結果轉為 /api/backtest 的 JSON 格式 ([{time, value}, ...]) """
+    curves = result["curves"]
+    payload = {k: v for k, v in result.items() if k != "curves"}
+    for field, name in CURVE_FIELDS.items():
+        payload[field] = [{"time": t, "value": safe_num(v)} for t, v in zip(curves["dates"], curves[name])]
+    return payload
+
+def render_binary_result(result) -> bytes:
+    """
+    二進位格式 (BINARY_MEDIA_TYPE):
+    [uint32 LE 標頭長度][UTF-8 JSON 標頭 (補空白至 8 bytes 對齊)][各曲線 little-endian float64 緩衝區]
+    標頭的 series 欄位記錄每條曲線在緩衝區中的 offset/length，前端可直接建立 Float64Array。
+    """
+    curves = result["curves"]
+    header = {k: v for k, v in result.items() if k != "curves"}
+    header["dates"] = curves["dates"]
+    header["series"] = {}
+
+    buffers = []
+    offset = 0
+    for name in CURVE_FIELDS.values():
+        arr = np.nan_to_num(np.asarray(curves[name], dtype="<f8"), nan=0.0, posinf=0.0, neginf=0.0)
+        header["series"][name] = {"offset": offset, "length": len(arr)}
+        buffers.append(arr.tobytes())
+        offset += arr.nbytes
+
+    header_bytes = json.dumps(jsonable_encoder(header), ensure_ascii=False).encode("utf-8")
+    header_bytes += b" " * ((-(4 + len(header_bytes))) % 8)
+    return struct.pack("<I", len(header_bytes)) + header_bytes + b"".join(buffers)
+
+def parse_binary_result(body: bytes):
+    """ render_binary_result 的反向轉換，還原為內部結果格式 """
+    header_len = struct.unpack_from("<I", body)[0]
+    result = json.loads(body[4:4 + header_len])
+    data_start = 4 + header_len
+    curves = {"dates": result.pop("dates")}
+    for name, layout in result.pop("series").items():
+        curves[name] = np.frombuffer(body, dtype="<f8", count=layout["length"], offset=data_start + layout["offset"])
+    result["curves"] = curves
+    return result
+
+def record_history(params: BacktestRequest, result_key: str, result):
+    """ 將回測結果寫入歷史紀錄；失敗只記錄錯誤，不影響回測回應 """
+    try:
+        summary = _summary_fields(result)
+        get_run_history().record(result_key, params.model_dump(), summary, render_binary_result(result))
+    except Exception as e:
+        print(f"[History] 寫入失敗: {e}")
+
+@app.get("/api/history", response_model=HistoryListResponse)
+async def list_history(
+    ticker: str = None,
+    strategy_mode: str = None,
+    sort_by: str = "created_at",
+    order: str = "desc",
+    limit: int = Query(default=50, ge=1, le=500),
+    offset: int = Query(default=0, ge=0),
+):
+    """ 列出歷史回測，可依股票代碼 / 模式篩選並依績效指標排序 """
+    if sort_by not in SORTABLE_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort_by 僅支援: {', '.join(SORTABLE_COLUMNS)}")
+    loop = asyncio.get_event_loop()
+    total, items = await loop.run_in_executor(
+        None, get_run_history().query, ticker, strategy_mode, sort_by, order, limit, offset
+    )
+    return {"total": total, "items": items}
+
+@app.get("/api/history/{run_id}")
+async def get_history_run(run_id: int, request: Request):
+    """ 取得單筆歷史回測的完整結果，格式與 /api/backtest 相同 (同樣支援二進位 Accept) """
+    await ensure_heavy_modules()
+    loop = asyncio.get_event_loop()
+    run = await loop.run_in_executor(None, get_run_history().get, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="找不到回測紀錄")
+
+    # 同一請求重跑時會覆寫紀錄並更新 created_at，ETag 隨之改變
+    binary = BINARY_MEDIA_TYPE in request.headers.get("accept", "")
+    etag = make_etag("run", RESULT_VERSION, run_id, run["created_at"], "binary" if binary else "json")
+    matched = match_etag(request.headers.get("if-none-match"), etag)
+    if matched:
+        return not_modified(matched)
+
+    if binary:
+        # 已是二進位格式，直接回傳解壓後的內容
+        body = run["payload"]
+    else:
+        result = parse_binary_result(run["payload"])
+        payload = jsonable_encoder(BacktestResponse(**render_json_result(result)))
+        payload["params"] = run["params"]
+        body = json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+    body, encoding = await loop.run_in_executor(None, encode_body, body, request.headers.get("accept-encoding"))
+    return cacheable_response(body, BINARY_MEDIA_TYPE if binary else "application/json", etag, encoding)
\ No newline at end of file
@@ -1,6 +1,8 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, conint, confloat, model_validator
 from typing import List, Dict, Optional, Any
 
+from .timeframe import TIMEFRAME_PATTERN
+
 class BacktestRequest(BaseModel):
     ticker: str
     start_date: str
@@ -14,6 +16,10 @@ class BacktestRequest(BaseModel):
     # --- 模式選擇 ---
     strategy_mode: str = "basic" 
 
+    # --- 多週期 (由日 K 合成) ---
+    timeframe: str = Field(default="D", pattern=TIMEFRAME_PATTERN, description="Bar timeframe: D / W / M / ND (N trading days)")
+    indicator_timeframe: Optional[str] = Field(default=None, pattern=TIMEFRAME_PATTERN, description="Compute indicators on this timeframe, aligned to bars without lookahead")
+
     # --- 定期定額 ---
     monthly_contribution_amount: float = Field(default=0.0, ge=0, description="Monthly contribution amount")
     monthly_contribution_fee: float = Field(default=1.0, ge=0, description="Monthly contribution fixed fee")
@@ -67,4 +73,65 @@ class BacktestResponse(BaseModel):
     trades: List[Dict]
     detailed_trades: Optional[List[Dict]] = [] 
     heatmap_data: Dict[int, Dict[int, float]]
-    buy_and_hold_curve: List[Dict]
\ No newline at end of file
+    buy_and_hold_curve: List[Dict]
+
+class DcaMatrixRequest(BaseModel):
+    ticker: str
+    start_date: str
+    end_date: str
+    cash: float = Field(default=100000, gt=0, description="Initial cash")
+    days: List[conint(ge=1, le=28)] = Field(default=list(range(1, 29)), min_length=1, max_length=28, description="Contribution days to compare (1-28)")
+    amounts: List[confloat(gt=0)] = Field(default=[5000.0], min_length=1, max_length=20, description="Monthly contribution amounts to compare")
+    fees: List[confloat(ge=0)] = Field(default=[1.0], min_length=1, max_length=10, description="Fixed fees per contribution to compare")
+
+    @model_validator(mode="after")
+    def check_fee_below_amount(self):
+        # 手續費 >= 金額時每次入金都是淨流出，回測會在現金耗盡後歸零，矩陣無法對應
+        if max(self.fees) >= min(self.amounts):
+            raise ValueError("手續費必須小於所有扣款金額")
+        return self
+
+class DcaMatrixResponse(BaseModel):
+    ticker: str
+    days: List[int]
+    amounts: List[float]
+    fees: List[float]
+    # 三維矩陣: [扣款日][金額][手續費]
+    final_equity: List[List[List[float]]]
+    invested: List[List[List[float]]]
+    annual_return: List[List[List[float]]]
+    best: Dict[str, float]
+
+class IngestRequest(BaseModel):
+    tickers: List[str] = Field(min_length=1, max_length=500, description="Tickers to ingest (digits get .TW appended)")
+    start_date: str
+    end_date: str
+    provider: Optional[str] = Field(default=None, description="yahoo / csv (default: BACKTEST_DATA_PROVIDER)")
+    batch_size: int = Field(default=20, ge=1, le=200)
+    max_concurrency: int = Field(default=4, ge=1, le=32)
+    retries: int = Field(default=3, ge=0, le=10)
+
+class IngestResponse(BaseModel):
+    ingested: List[str]
+    failed: Dict[str, str]
+
+class HistoryItem(BaseModel):
+    id: int
+    created_at: float
+    ticker: str
+    strategy_mode: str
+    start_date: str
+    end_date: str
+    final_equity: Optional[float] = None
+    total_return: Optional[float] = None
+    annual_return: Optional[float] = None
+    sharpe_ratio: Optional[float] = None
+    max_drawdown: Optional[float] = None
+    win_rate: Optional[float] = None
+    profit_factor: Optional[float] = None
+    total_trades: Optional[int] = None
+    params: Dict[str, Any]
+
+class HistoryListResponse(BaseModel):
+    total: int
+    items: List[HistoryItem]
@@ -2,10 +2,15 @@ from backtesting import Strategy
 from backtesting.lib import crossover
 import pandas as pd
 import numpy as np
+from functools import wraps
+
+from .timeframe import align_to_bars
 
 # ==========================================
-#  技術指標計算函數庫 
+#  技術指標計算函數庫 (pandas 參考實作)
 # ==========================================
+# 策略實際使用下方的 IndicatorBank；這些函數保留作為其輸出的參考定義，
+# 修改 IndicatorBank 後以它們逐一比對結果 (見 IndicatorBank 的「與上方指標函數相同的輸出」)。
 def SMA(values, n):
     """ 簡單移動平均線 """
     return pd.Series(values).rolling(n).mean()
@@ -63,6 +68,273 @@ def DONCHIAN_LOW(low, n=20):
     """ 海龜法則: 過去 N 日的最低價 (不含今日) """
     return pd.Series(low).rolling(n).min().shift(1)
 
+# ==========================================
+#  指標庫 (多週期共用的滾動視窗核心)
+# ==========================================
+def _rolling_extrema_table(values, max_window, op, levels=None):
+    """
+    Sparse table: levels[k][i] = op(values[i : i + 2^k])。
+    建表 O(n log W) 只做一次，之後任意 w <= max_window 的滾動極值都只需兩次查表 (O(n))。
+    """
+    levels = levels or [values]
+    span = 1 << (len(levels) - 1)
+    while span * 2 <= max_window and span < len(values):
+        prev = levels[-1]
+        levels.append(op(prev[:-span], prev[span:]))
+        span *= 2
+    return levels
+
+
+class IndicatorBank:
+    """
+    指標庫: 同一條序列的所有週期共用一次前處理，
+    滾動極值共用 sparse table、滾動平均 / 標準差共用累積和、EWM 依 (序列, 參數) 去重，
+    多週期查詢回傳 (週期數, K 棒數) 的連續二維陣列。
+    與 pandas rolling 的語意相同 (min_periods = n)：視窗不足或含 NaN 時為 NaN，NaN 不會影響之後的視窗。
+    """
+
+    def __init__(self, **series):
+        self.series = {name: np.asarray(values, dtype=float) for name, values in series.items()}
+        self._tables = {}
+        self._cumsums = {}
+        self._ewm = {}
+        self._cache = {}
+
+    def __len__(self):
+        return len(next(iter(self.series.values()))) if self.series else 0
+
+    def _rolling_extrema(self, name, windows, op):
+        values = self.series[name]
+        n = len(values)
+        key = (name, op.__name__)
+        self._tables[key] = levels = _rolling_extrema_table(values, max(windows), op, self._tables.get(key))
+
+        out = np.full((len(windows), n), np.nan)
+        for row, w in enumerate(windows):
+            # 視窗 < 1 (如使用者傳入 period 0) 與 pandas rolling(0) 一樣整列 NaN
+            if w < 1 or w > n: continue
+            k = w.bit_length() - 1
+            s = 1 << k
+            table = levels[k]
+            out[row, w - 1:] = op(table[:n - w + 1], table[w - s:n - s + 1])
+        return out
+
+    def rolling_max(self, name, windows):
+        """ 各週期的滾動最高值，shape = (len(windows), n) """
+        return self._rolling_extrema(name, [int(w) for w in windows], np.maximum)
+
+    def rolling_min(self, name, windows):
+        """ 各週期的滾動最低值，shape = (len(windows), n) """
+        return self._rolling_extrema(name, [int(w) for w in windows], np.minimum)
+
+    def _sums(self, name):
+        # 先減去序列平均再累加，降低大數相減的誤差；
+        # NaN 以 0 累加並另計個數，否則一個 NaN 會讓之後所有視窗都變成 NaN
+        if name not in self._cumsums:
+            values = self.series[name]
+            missing = np.isnan(values)
+            offset = np.mean(values[~missing]) if (~missing).any() else 0.0
+            centered = np.where(missing, 0.0, values - offset)
+            s0 = np.concatenate(([0], np.cumsum(missing)))
+            s1 = np.concatenate(([0.0], np.cumsum(centered)))
+            s2 = np.concatenate(([0.0], np.cumsum(centered * centered)))
+            self._cumsums[name] = (offset, s0, s1, s2)
+        return self._cumsums[name]
+
+    def rolling_moments(self, name, windows, ddof=1):
+        """ 各週期的滾動平均與標準差 (一次累積和)，回傳 (means, stds)，shape 皆為 (len(windows), n) """
+        windows = [int(w) for w in windows]
+        offset, s0, s1, s2 = self._sums(name)
+        n = len(s1) - 1
+        means = np.full((len(windows), n), np.nan)
+        stds = np.full((len(windows), n), np.nan)
+        for row, w in enumerate(windows):
+            if w < 1 or w > n: continue
+            total = s1[w:] - s1[:-w]
+            total_sq = s2[w:] - s2[:-w]
+            # 視窗內含 NaN 時結果為 NaN (min_periods = n)
+            complete = s0[w:] == s0[:-w]
+            means[row, w - 1:] = np.where(complete, total / w + offset, np.nan)
+            if w > ddof:
+                var = (total_sq - total * total / w) / (w - ddof)
+                stds[row, w - 1:] = np.where(complete, np.sqrt(np.maximum(var, 0.0)), np.nan)
+        # 視窗內數值全相同 (如停牌) 時，與 pandas 一樣直接給出該值與 0，避免相減誤差
+        highs = self.rolling_max(name, windows)
+        flat = highs == self.rolling_min(name, windows)
+        means[flat] = highs[flat]
+        stds[flat & ~np.isnan(stds)] = 0.0
+        return means, stds
+
+    def rolling_mean(self, name, windows):
+        return self.rolling_moments(name, windows)[0]
+
+    def rolling_std(self, name, windows, ddof=1):
+        return self.rolling_moments(name, windows, ddof)[1]
+
+    def ewm(self, name, values=None, **kwargs):
+        """ pandas ewm(adjust=False).mean()，相同 (序列, 參數) 只算一次；衍生序列需提供 values """
+        key = (name, tuple(sorted(kwargs.items())))
+        if key not in self._ewm:
+            source = self.series[name] if values is None else values
+            self._ewm[key] = pd.Series(source).ewm(adjust=False, **kwargs).mean().to_numpy()
+        return self._ewm[key]
+
+    def _cached(self, key, func):
+        if key not in self._cache: self._cache[key] = func()
+        return self._cache[key]
+
+    # --- 與上方指標函數相同的輸出 (供 Strategy.I 使用) ---
+    def sma(self, n):
+        return self.rolling_mean("Close", [n])[0]
+
+    def bbands(self, n=20, std=2.0):
+        means, stds = self.rolling_moments("Close", [n])
+        return means[0] + std * stds[0], means[0] - std * stds[0]
+
+    def rsi(self, n=14):
+        def compute():
+            delta = np.diff(self.series["Close"], prepend=np.nan)
+            gain = np.where(delta > 0, delta, 0.0)
+            loss = -np.where(delta < 0, delta, 0.0)
+            avg_gain = self.ewm("Close.gain", gain, com=n - 1)
+            avg_loss = self.ewm("Close.loss", loss, com=n - 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return 100 - (100 / (1 + avg_gain / avg_loss))
+        return self._cached(("RSI", n), compute)
+
+    def macd(self, fast=12, slow=26, signal=9):
+        macd = self.ewm("Close", span=fast) - self.ewm("Close", span=slow)
+        return macd, self.ewm(f"MACD_{fast}_{slow}", macd, span=signal)
+
+    def kd(self, n=9):
+        highest_high = self.rolling_max("High", [n])[0]
+        lowest_low = self.rolling_min("Low", [n])[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsv = (self.series["Close"] - lowest_low) / (highest_high - lowest_low) * 100
+        k = self.ewm(f"RSV_{n}", rsv, com=2)
+        return k, self.ewm(f"K_{n}", k, com=2)
+
+    def willr(self, n=14):
+        highest_high = self.rolling_max("High", [n])[0]
+        lowest_low = self.rolling_min("Low", [n])[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (highest_high - self.series["Close"]) / (highest_high - lowest_low) * -100
+
+    def donchian_high(self, n=20):
+        return np.concatenate(([np.nan], self.rolling_max("High", [n])[0][:-1]))
+
+    def donchian_low(self, n=20):
+        return np.concatenate(([np.nan], self.rolling_min("Low", [n])[0][:-1]))
+
+# ==========================================
+#  定期定額排程
+# ==========================================
+def contribution_schedule(index, days, amount, initial=0.0):
+    """
+    定期定額入金排程 (向量化計算，策略與 ROI 曲線共用)
+    每個扣款日 d 在每個月第一根「日期 >= d」的 K 棒入金一次 (該日休市則順延)。
+    回傳 (每根 K 棒的入金次數, 每根 K 棒的累積投入資金)
+    """
+    index = pd.DatetimeIndex(index)
+    counts = np.zeros(len(index), dtype=np.int64)
+    if amount > 0 and days and len(index) > 0:
+        month_key = index.year.to_numpy() * 12 + index.month.to_numpy()
+        day = index.day.to_numpy()
+        for d in set(days):
+            pos = np.flatnonzero(day >= d)
+            # 每個月份第一個符合條件的位置
+            _, first = np.unique(month_key[pos], return_index=True)
+            counts[pos[first]] += 1
+    invested = initial + np.cumsum(counts) * amount
+    return counts, invested
+
+def dca_matrix(index, close, cash, days, amounts, fees, first_bar=1):
+    """
+    定期定額比較矩陣: 一次算出「扣款日 x 金額 x 手續費」所有組合的結果，不需逐格執行 backtesting.py。
+    規則與 periodic 模式的 UniversalStrategy 相同:
+    - backtesting.py 從 first_bar 開始呼叫 next()，當根補足本月稍早的入金，更早的入金不執行
+    - 每次入金扣除固定手續費，以 int((金額 - 手續費) / 收盤價) 股買進；初始資金在第一根 K 棒一次買進
+    - 買單以當根收盤價成交 (trade_on_close)，最後一根送出的買單沒有下一根可成交
+    - 期末資產在最後一根 K 棒的 next() 之前記錄，最後一根的入金與手續費不計入
+    回傳 dict: final_equity / invested / annual_return (年化資金加權報酬率 %)，
+    皆為 (len(days), len(amounts), len(fees)) 陣列
+    """
+    index = pd.DatetimeIndex(index)
+    close = np.asarray(close, dtype=float)
+    amounts = np.asarray(amounts, dtype=float)
+    fees = np.asarray(fees, dtype=float)
+    n = len(close)
+
+    # 入金矩陣 D: 每個扣款日一列，每根 K 棒的入金次數 (與單一扣款日的 contribution_schedule 相同)
+    scheduled = np.vstack([contribution_schedule(index, [d], 1.0)[0] for d in days])
+    month_key = index.year.to_numpy() * 12 + index.month.to_numpy()
+    month_start = np.searchsorted(month_key, month_key[first_bar])
+    deposits = scheduled.copy()
+    deposits[:, :first_bar] = 0
+    deposits[:, first_bar] = scheduled[:, month_start:first_bar + 1].sum(axis=1)
+
+    # 各 (金額, 手續費) 每根 K 棒可買股數: floor((a - f) / price)，shape = (A, F, n - 1)
+    net = amounts[:, None] - fees[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(net[..., None] > 0, np.floor(net[..., None] / close[None, None, :n - 1]), 0.0)
+    shares = np.nan_to_num(shares, nan=0.0, posinf=0.0, neginf=0.0).reshape(-1, n - 1)
+    filled = deposits[:, :n - 1].astype(float)
+    total_shares = (filled @ shares.T).reshape(len(days), *net.shape)
+    total_cost = (filled @ (shares * close[:n - 1]).T).reshape(len(days), *net.shape)
+
+    # 初始資金: 第一根 K 棒 (已含當根入金) 扣一次手續費後全數買進。
+    # 策略以 init 時取得的 self.price (整段收盤價) 判斷資金是否足夠，[-1] 是最後一根而非當根的收盤價
+    price0 = close[first_bar]
+    available = cash + deposits[:, first_bar, None, None] * net[None]
+    initial_buy = (available > close[-1]) & (available > fees[None, None, :]) & (first_bar < n - 1)
+    initial_shares = np.where(initial_buy, np.floor((available - fees) / price0), 0.0)
+
+    # 最後一根 K 棒的入金發生在記錄期末資產之後，不計入
+    settled = deposits.copy()
+    settled[:, n - 1] = 0
+    n_deposits = settled.sum(axis=1)[:, None, None]
+    final_cash = cash + n_deposits * net[None] - np.where(initial_buy, fees[None, None, :], 0.0)
+    final_equity = (final_cash + total_shares * close[-1] - total_cost
+                    + initial_shares * (close[-1] - price0))
+    invested = cash + scheduled.sum(axis=1)[:, None, None] * amounts[None, :, None] + np.zeros_like(final_equity)
+
+    years = (index - index[0]).days.to_numpy() / 365.0
+    annual_return = _money_weighted_return(cash, settled, amounts, final_equity, years)
+    return {"final_equity": final_equity, "invested": invested, "annual_return": annual_return}
+
+
+def _money_weighted_return(cash, deposits, amounts, final_equity, years, iterations=80):
+    """
+    年化資金加權報酬率 (IRR，%): 期初投入 cash、各入金日投入 amount、期末取回 final_equity。
+    所有流出都在流入之前，終值 FV(g) 對成長率 g = 1 + r 單調遞減，以向量化二分法求根。
+    """
+    horizon = years[-1]
+    if horizon <= 0:
+        return np.zeros_like(final_equity)
+
+    # 每個扣款日的入金時間點 (距期末年數)，補齊成同長度並以權重 0 填充
+    remaining = [np.repeat(horizon - years, d.astype(int)) for d in deposits]
+    width = max((len(r) for r in remaining), default=0)
+    to_end = np.zeros((len(remaining), max(width, 1)))
+    weight = np.zeros_like(to_end)
+    for row, r in enumerate(remaining):
+        to_end[row, :len(r)] = r
+        weight[row, :len(r)] = 1.0
+    to_end = to_end[:, None, None, :]
+    weight = weight[:, None, None, :] * np.asarray(amounts, dtype=float)[None, :, None, None]
+
+    def future_value(g):
+        return final_equity - cash * g ** horizon - (weight * g[..., None] ** to_end).sum(axis=-1)
+
+    low = np.full(final_equity.shape, 1e-6)
+    high = np.full(final_equity.shape, 101.0)
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        positive = future_value(mid) > 0
+        low = np.where(positive, mid, low)
+        high = np.where(positive, high, mid)
+    return ((low + high) / 2 - 1) * 100
+
 # ==========================================
 #  通用策略類別
 # ==========================================
@@ -76,23 +348,36 @@ class UniversalStrategy(Strategy):
     monthly_contribution_amount = 0.0
     monthly_contribution_fee = 1.0
     monthly_contribution_days = []
+    contribution_counts = None  # contribution_schedule 的每棒入金次數，未提供時於 init 自行計算
     commission_rate = 0.0
+    progress_callback = None  # 串流模式: 每根 K 棒回報 (已處理棒數, 總棒數)
+    indicator_data = None  # 高週期 K 棒 (DataFrame)；提供時指標改以其計算後再對齊回交易 K 棒
 
     def init(self):
         self.price = self.data.Close
         self.total_bars = len(self.data) 
         
         # 定期定額輔助變數
-        self.last_month = -1
-        self.deposited_targets = set()
+        if self.contribution_counts is None:
+            self.contribution_counts, _ = contribution_schedule(
+                self.data.index, self.monthly_contribution_days, self.monthly_contribution_amount)
+        counts = np.asarray(self.contribution_counts)
+        month_key = self.data.index.year.to_numpy() * 12 + self.data.index.month.to_numpy()
+        # 第一次執行 next() 時可能已錯過本月稍早的入金 (指標暖機期)，需一次補足
+        self._deposits_cum = np.cumsum(counts)
+        self._month_first_bar = np.searchsorted(month_key, month_key)
+        self._deposits_started = False
         self.initial_bought = False
         self.order_log = [] 
+        # 所有指標共用同一個指標庫: 同一序列的多個週期只做一次前處理
+        source = self.indicator_data if self.indicator_data is not None else self.data
+        self.bank = IndicatorBank(High=source.High, Low=source.Low, Close=source.Close)
 
         if self.mode == "basic":
-            self.sma1 = self.I(SMA, self.price, self.n1)
-            self.sma2 = self.I(SMA, self.price, self.n2)
-            self.rsi_entry = self.I(RSI, self.price, self.n_rsi_entry)
-            self.rsi_exit = self.I(RSI, self.price, self.n_rsi_exit)
+            self.sma1 = self.I(self._indicator(self.bank.sma), self.n1)
+            self.sma2 = self.I(self._indicator(self.bank.sma), self.n2)
+            self.rsi_entry = self.I(self._indicator(self.bank.rsi), self.n_rsi_entry)
+            self.rsi_exit = self.I(self._indicator(self.bank.rsi), self.n_rsi_exit)
 
         elif self.mode == "advanced":
             all_configs = self.entry_config + self.exit_config
@@ -103,35 +388,49 @@ class UniversalStrategy(Strategy):
                 if stype in ['SMA_CROSS', 'SMA_DEATH']:
                     n_s = int(p.get('n_short', 10))
                     n_l = int(p.get('n_long', 60))
-                    self._register_indicator(f"SMA_{n_s}", SMA, self.price, n_s)
-                    self._register_indicator(f"SMA_{n_l}", SMA, self.price, n_l)
+                    self._register_indicator(f"SMA_{n_s}", self.bank.sma, n_s)
+                    self._register_indicator(f"SMA_{n_l}", self.bank.sma, n_l)
                 elif stype in ['RSI_OVERSOLD', 'RSI_OVERBOUGHT']:
                     per = int(p.get('period', 14))
-                    self._register_indicator(f"RSI_{per}", RSI, self.price, per)
+                    self._register_indicator(f"RSI_{per}", self.bank.rsi, per)
                 elif stype in ['MACD_GOLDEN', 'MACD_DEATH']:
                     f = int(p.get('fast', 12))
                     s = int(p.get('slow', 26))
                     sig = int(p.get('signal', 9))
-                    self._register_indicator(f"MACD_{f}_{s}_{sig}", MACD, self.price, f, s, sig)
+                    self._register_indicator(f"MACD_{f}_{s}_{sig}", self.bank.macd, f, s, sig)
                 elif stype in ['KD_GOLDEN', 'KD_DEATH']:
                     per = int(p.get('period', 9))
-                    self._register_indicator(f"KD_{per}", KD, self.data.High, self.data.Low, self.data.Close, per)
+                    self._register_indicator(f"KD_{per}", self.bank.kd, per)
                 elif stype in ['BB_LOWER', 'BB_UPPER', 'BB_BREAK', 'BB_REVERSE']:
                     per = int(p.get('period', 20))
                     std = float(p.get('std', 2.0))
-                    self._register_indicator(f"BB_{per}_{std}", BBANDS, self.price, per, std)
+                    self._register_indicator(f"BB_{per}_{std}", self.bank.bbands, per, std)
                 elif stype in ['WILLR_OVERSOLD', 'WILLR_OVERBOUGHT']:
                     per = int(p.get('period', 14))
-                    self._register_indicator(f"WILLR_{per}", WILLR, self.data.High, self.data.Low, self.data.Close, per)
+                    self._register_indicator(f"WILLR_{per}", self.bank.willr, per)
                 elif stype in ['TURTLE_ENTRY', 'TURTLE_EXIT']:
                     per = int(p.get('period', 20))
                     if 'ENTRY' in stype:
-                        self._register_indicator(f"DONCHIAN_HIGH_{per}", DONCHIAN_HIGH, self.data.High, per)
+                        self._register_indicator(f"DONCHIAN_HIGH_{per}", self.bank.donchian_high, per)
                     else:
-                        self._register_indicator(f"DONCHIAN_LOW_{per}", DONCHIAN_LOW, self.data.Low, per)
+                        self._register_indicator(f"DONCHIAN_LOW_{per}", self.bank.donchian_low, per)
+
+    def _indicator(self, func):
+        """ 使用高週期指標時，將結果對齊到交易 K 棒 (只取已收盤完成的高週期 K 棒，無未來函數) """
+        if self.indicator_data is None: return func
+        source_index = self.indicator_data.index
+        target_index = self.data.index
+
+        @wraps(func)
+        def aligned(*args):
+            out = func(*args)
+            if isinstance(out, tuple):
+                return tuple(align_to_bars(v, source_index, target_index) for v in out)
+            return align_to_bars(out, source_index, target_index)
+        return aligned
 
     def _register_indicator(self, key, func, *args):
-        if not hasattr(self, key): setattr(self, key, self.I(func, *args))
+        if not hasattr(self, key): setattr(self, key, self.I(self._indicator(func), *args))
 
     def check_signal(self, config_list, is_entry=True):
         if not config_list: return False
@@ -221,40 +520,41 @@ class UniversalStrategy(Strategy):
 
     def next(self):
         price = self.data.Close[-1]
+
+        if self.progress_callback is not None:
+            self.progress_callback(len(self.data), self.total_bars)
         
         # -----------------------------
         # 定期定額入金 (Monthly Contribution)
         # -----------------------------
         if self.monthly_contribution_amount > 0 and self.monthly_contribution_days:
-            current_date = self.data.index[-1]
-            current_month = current_date.month
-            current_day = current_date.day
-            
-            if current_month != self.last_month:
-                self.deposited_targets = set()
-                self.last_month = current_month
+            bar = len(self.data) - 1
+            if self._deposits_started:
+                n_deposits = int(self.contribution_counts[bar])
+            else:
+                first = self._month_first_bar[bar]
+                n_deposits = int(self._deposits_cum[bar] - (self._deposits_cum[first - 1] if first > 0 else 0))
+                self._deposits_started = True
+
+            for _ in range(n_deposits):
+                self._broker._cash += self.monthly_contribution_amount
                 
-            for target_day in self.monthly_contribution_days:
-                if current_day >= target_day and target_day not in self.deposited_targets:
-                    self._broker._cash += self.monthly_contribution_amount
-                    self.deposited_targets.add(target_day)
+                if self.mode == 'periodic':
+                    # 1. 扣除定額手續費 (直接從現金扣除)
+                    self._broker._cash -= self.monthly_contribution_fee
                     
-                    if self.mode == 'periodic':
-                        # 1. 扣除定額手續費 (直接從現金扣除)
-                        self._broker._cash -= self.monthly_contribution_fee
-                        
-                        # 2. 計算可用於買股的資金
-                        available_for_stock = self.monthly_contribution_amount - self.monthly_contribution_fee
-                        if available_for_stock > 0:
-
-                            buy_size = int(available_for_stock / price)
-                            if buy_size > 0:
-                                self.buy(size=buy_size)
-                                self.order_log.append({
-                                    "time": self.data.index[-1],
-                                    "type": "buy",
-                                    "price": price
-                                })
+                    # 2. 計算可用於買股的資金
+                    available_for_stock = self.monthly_contribution_amount - self.monthly_contribution_fee
+                    if available_for_stock > 0:
+
+                        buy_size = int(available_for_stock / price)
+                        if buy_size > 0:
+                            self.buy(size=buy_size)
+                            self.order_log.append({
+                                "time": self.data.index[-1],
+                                "type": "buy",
+                                "price": price
+                            })
 
         # [Periodic Only] 定期定額模式：初始資金的處理 
 
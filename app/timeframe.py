@@ -0,0 +1,90 @@
+import re
+
+from .cache import get_shared_cache
+
+# ==========================================
+#  多週期 (Multi-Timeframe)
+# ==========================================
+# 由快取中的日 K 合成週 K / 月 K / N 日 K，不需重新下載。
+# 合成後的 K 棒以「該區間最後一個交易日」為時間標籤，也就是該根 K 棒收盤完成的時間點，
+# 因此對齊回日 K 時只要取「標籤 <= 當日」的最後一根，即不會用到尚未完成的高週期 K 棒 (無未來函數)。
+# numpy / pandas 只在實際使用時才 import，維持 app.main 的快速啟動。
+
+TIMEFRAME_PATTERN = r"^(D|W|M|[1-9][0-9]?D)$"
+
+OHLCV_AGG = {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+
+
+def normalize_timeframe(timeframe) -> str:
+    """ 統一週期格式 ("w" -> "W"、"1D" -> "D")，None 視為日 K """
+    timeframe = (timeframe or "D").upper().strip()
+    if not re.match(TIMEFRAME_PATTERN, timeframe):
+        raise ValueError(f"不支援的週期: {timeframe} (可用 D / W / M / ND)")
+    return "D" if timeframe == "1D" else timeframe
+
+
+def _group_keys(index, timeframe):
+    import numpy as np
+
+    if timeframe == "W":
+        return index.to_period("W-FRI")
+    if timeframe == "M":
+        return index.to_period("M")
+    # N 日 K: 每 N 個交易日合成一根 (以交易日計，不受假日影響)
+    return np.arange(len(index)) // int(timeframe[:-1])
+
+
+def resample_ohlcv(df, timeframe):
+    """ 將日 K 合成為高週期 K 棒，時間標籤為各區間最後一個交易日 """
+    timeframe = normalize_timeframe(timeframe)
+    if timeframe == "D": return df
+
+    keys = _group_keys(df.index, timeframe)
+    grouped = df.groupby(keys, sort=True)
+    agg = {col: how for col, how in OHLCV_AGG.items() if col in df.columns}
+    out = grouped.agg(agg)
+    out.index = df.index.to_series().groupby(keys, sort=True).max().to_numpy()
+    out.index.name = df.index.name
+    return out.dropna(subset=["Close"])
+
+
+def aggregate_to_bars(values, index, timeframe):
+    """
+    將日 K 上的數值 (如每日入金次數) 依 resample_ohlcv 的分組加總，
+    回傳與合成後 K 棒一一對應的陣列；日 K 原樣回傳
+    """
+    import numpy as np
+    import pandas as pd
+
+    timeframe = normalize_timeframe(timeframe)
+    values = np.asarray(values)
+    if timeframe == "D": return values
+    return pd.Series(values).groupby(_group_keys(index, timeframe), sort=True).sum().to_numpy()
+
+
+def get_resampled(df, ticker, timeframe, version, cache=None):
+    """ 取得合成後的 K 棒，依 (代碼, 週期, 數據版本) 存入共享快取 """
+    timeframe = normalize_timeframe(timeframe)
+    if timeframe == "D": return df
+
+    cache = cache or get_shared_cache()
+    key = f"{ticker}|{timeframe}|{version}"
+    resampled = cache.get("ohlcv_resampled", key)
+    if resampled is None:
+        resampled = resample_ohlcv(df, timeframe)
+        cache.set("ohlcv_resampled", key, resampled)
+    return resampled
+
+
+def align_to_bars(values, source_index, target_index):
+    """
+    將高週期指標對齊到較低週期的 K 棒: 每根目標 K 棒取「已收盤完成」的最後一根來源 K 棒的值，
+    之前沒有已完成 K 棒的位置為 NaN。values 可為一維或 (n 條, 來源棒數) 的二維陣列。
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    pos = np.searchsorted(np.asarray(source_index), np.asarray(target_index), side="right") - 1
+    aligned = values[..., np.maximum(pos, 0)]
+    aligned[..., pos < 0] = np.nan
+    return aligned
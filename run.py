@@ -6,6 +6,10 @@ import sys
 import os
 import psutil
 import socket
+import argparse
+import subprocess
+import urllib.request
+import urllib.error
 
 def is_port_in_use(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -25,25 +29,98 @@ def kill_process_on_port(port):
         except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
             pass
 
-def start_browser():
-    """等待 2 秒讓 Server 啟動後，自動開啟預設瀏覽器"""
-    time.sleep(2)
-    url = "http://127.0.0.1:8000"
+def wait_until_ready(port, timeout=30.0):
+    """輪詢 /api/ready，直到伺服器回報就緒 (重量級模組已預熱) 或逾時"""
+    url = f"http://127.0.0.1:{port}/api/ready"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.1)
+    return False
+
+def start_browser(port=8000):
+    """等待 Server 回報就緒後，自動開啟預設瀏覽器"""
+    if not wait_until_ready(port):
+        print("警告：等待伺服器就緒逾時，仍嘗試開啟瀏覽器")
+    url = f"http://127.0.0.1:{port}"
     print(f"正在開啟瀏覽器: {url}")
     webbrowser.open(url)
 
+def startup_report(budget_ms, top=15):
+    """以 python -X importtime 量測 import app.main 與背景預熱的耗時，並與啟動預算比較"""
+    code = (
+        "import time; t = time.perf_counter(); import app.main as m; "
+        "t1 = time.perf_counter(); m.load_heavy_modules(); t2 = time.perf_counter(); "
+        "print(f'{(t1 - t) * 1000:.1f} {(t2 - t1) * 1000:.1f}')"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        print(proc.stderr)
+        return False
+
+    # importtime 格式: "import time: self [us] | cumulative | imported package"，套件名稱的縮排代表巢狀深度
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, self_us, cumulative_us, name = line.replace("import time:", "|", 1).split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            entries.append((int(cumulative_us), int(self_us), "  " * depth + name.strip()))
+
+    import_ms, warmup_ms = (float(v) for v in proc.stdout.split()[-2:])
+    print("=== 啟動時間報告 ===")
+    print(f"import app.main : {import_ms:8.1f} ms  (預算 {budget_ms} ms)")
+    print(f"背景預熱        : {warmup_ms:8.1f} ms  (伺服器監聽後才執行，不計入冷啟動)")
+    print("--- 最耗時的模組 (cumulative，縮排表示被上一層模組引入) ---")
+    for cumulative_us, self_us, name in sorted(entries, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:8.1f} ms  {name}")
+
+    within = import_ms <= budget_ms
+    print("結果: " + ("符合預算" if within else "超出預算"))
+    return within
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="回測系統啟動腳本")
+    parser.add_argument("--prod", action="store_true", help="正式環境模式: 多 worker、不自動重載、不清理端口、不開瀏覽器")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="正式環境模式的 worker 數量 (預設為 CPU 核心數)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--startup-report", action="store_true", help="顯示 import 耗時報告後結束 (超出預算時 exit code 為 1)")
+    parser.add_argument("--startup-budget-ms", type=float, default=500, help="import app.main 的時間預算 (毫秒)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    if args.startup_report:
+        sys.exit(0 if startup_report(args.startup_budget_ms) else 1)
+
+    if args.prod:
+        # 多個 worker 透過 data/cache.sqlite3 共享行情與回測結果快取
+        print(f"正在以正式環境模式啟動 ({args.workers} workers)..")
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers, reload=False)
+        sys.exit(0)
+
     # 確保端口乾淨
-    if is_port_in_use(8000):
+    if is_port_in_use(args.port):
         try:
-            kill_process_on_port(8000)
+            kill_process_on_port(args.port)
             # 稍作等待確保系統釋放資源
             time.sleep(1)
         except Exception as e:
-            print(f"警告：無法清理端口 8000: {e}")
+            print(f"警告：無法清理端口 {args.port}: {e}")
             print("嘗試直接啟動...")
 
-    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-    threading.Thread(target=start_browser, daemon=True).start()
+    threading.Thread(target=start_browser, args=(args.port,), daemon=True).start()
     print("正在啟動 ..")
-    uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("app.main:app", host=args.host, port=args.port, reload=True)
\ No newline at end of file
@@ -5,6 +5,7 @@ let drawdownChart = null;
 let lockedDatasets = [];
 let lastChartData = null;
 let currentMode = 'basic';
+let backtestController = null;
 
 // 定義策略選項與參數
 const STATIC_INPUT_CONSTRAINTS = {
@@ -168,8 +169,8 @@ document.addEventListener('DOMContentLoaded', function () {
     window.addEventListener('themeChanged', function () {
         if (lastChartData) {
             setTimeout(() => {
-                renderMainChart(lastChartData.priceData, lastChartData.trades, lastChartData.equityData, lastChartData.bhData);
-                renderDrawdownChart(lastChartData.drawdownCurve);
+                renderMainChart(lastChartData.curves, lastChartData.trades);
+                renderDrawdownChart(lastChartData.curves);
                 renderPnLHistogram(lastChartData.pnlData);
             }, 50);
         }
@@ -178,6 +179,9 @@ document.addEventListener('DOMContentLoaded', function () {
     // 初始化下拉選單 (進階模式)
     initStrategySelects();
 
+    // 載入歷史回測紀錄
+    refreshHistoryList();
+
     // 初始化基礎模式的限制與提示
     initStaticConstraints();
 
@@ -496,7 +500,15 @@ function handleTickerInput(e) {
     }
 }
 
+const SPINNER_SVG = `<svg class="animate-spin -ml-1 mr-3 h-5 w-5 text-white" xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24"><circle class="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" stroke-width="4"></circle><path class="opacity-75" fill="currentColor" d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"></path></svg>`;
+
 async function executeBacktest() {
+    // 回測進行中再次點擊按鈕 = 取消，中斷串流後伺服器也會停止運算
+    if (backtestController) {
+        backtestController.abort();
+        return;
+    }
+
     console.log("Backtest started...");
     const tickerInput = document.getElementById('ticker');
     const ticker = tickerInput.value.trim();
@@ -506,8 +518,7 @@ async function executeBacktest() {
     const originalText = btn.innerHTML;
     const chartContainer = document.getElementById('chartContainer');
 
-    btn.disabled = true;
-    btn.innerHTML = `<svg class="animate-spin -ml-1 mr-3 h-5 w-5 text-white" xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24"><circle class="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" stroke-width="4"></circle><path class="opacity-75" fill="currentColor" d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"></path></svg> 運算中...`;
+    btn.innerHTML = `${SPINNER_SVG} 運算中... (點擊取消)`;
     chartContainer.classList.add('opacity-50', 'pointer-events-none');
     document.body.style.cursor = 'wait';
 
@@ -525,7 +536,9 @@ async function executeBacktest() {
         stop_loss_pct: parseFloat(document.getElementById('sl_pct').value),
         take_profit_pct: parseFloat(document.getElementById('tp_pct').value),
         trailing_stop_pct: parseFloat(document.getElementById('ts_pct').value) || 0,
-        strategy_mode: currentMode
+        strategy_mode: currentMode,
+        timeframe: document.getElementById('timeframe').value,
+        indicator_timeframe: document.getElementById('indicator_timeframe').value || null
     };
 
     // 定期定額參數
@@ -579,11 +592,16 @@ async function executeBacktest() {
         payload.exit_params_2 = x2_params;
     }
 
+    backtestController = new AbortController();
+    let summaryShown = false;
+
     try {
-        const res = await fetch('/api/backtest', {
+        // 串流只取進度與摘要，完整結果改以二進位格式取回 (伺服器已寫入快取，不會重算)
+        const res = await fetch('/api/backtest/stream?include_result=false', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+            body: JSON.stringify(payload),
+            signal: backtestController.signal
         });
 
         if (!res.ok) {
@@ -591,21 +609,168 @@ async function executeBacktest() {
             throw new Error(err.detail || "請求失敗");
         }
 
-        const data = await res.json();
-        updateDashboard(data);
+        let finished = false;
+        await readEventStream(res, (event, eventData) => {
+            if (event === 'progress') {
+                const pct = eventData.total_bars ? Math.floor(eventData.bars / eventData.total_bars * 100) : 0;
+                btn.innerHTML = `${SPINNER_SVG} 運算中 ${pct}% (點擊取消)`;
+            } else if (event === 'summary') {
+                // 績效摘要先到，先更新數字卡片，圖表等完整結果
+                updateSummary(eventData);
+                summaryShown = true;
+            } else if (event === 'done') {
+                finished = true;
+            } else if (event === 'error') {
+                throw new Error(eventData.detail || "請求失敗");
+            }
+        });
+
+        if (!finished) throw new Error("連線中斷，未收到完整結果");
+        const data = await fetchBinaryResult(payload, backtestController.signal);
+        updateDashboard(data, summaryShown);
         showToast("回測執行成功", "success");
+        refreshHistoryList();
 
     } catch (err) {
-        showToast('執行失敗: ' + err.message, 'error');
-        console.error(err);
+        if (err.name === 'AbortError') {
+            showToast("已取消回測", "info");
+        } else {
+            showToast('執行失敗: ' + err.message, 'error');
+            console.error(err);
+        }
     } finally {
-        btn.disabled = false;
+        backtestController = null;
         btn.innerHTML = originalText;
         chartContainer.classList.remove('opacity-50', 'pointer-events-none');
         document.body.style.cursor = 'default';
     }
 }
 
+const BINARY_MEDIA_TYPE = 'application/x-backtest-f64';
+
+// POST 回應不會進入瀏覽器快取，自行保留最近的結果並以 If-None-Match 驗證 (未變更時伺服器回 304)
+const RESULT_CACHE_SIZE = 8;
+const resultCache = new Map();
+
+async function fetchBinaryResult(payload, signal) {
+    const body = JSON.stringify(payload);
+    const cached = resultCache.get(body);
+    const headers = { 'Content-Type': 'application/json', 'Accept': BINARY_MEDIA_TYPE };
+    if (cached) headers['If-None-Match'] = cached.etag;
+
+    const res = await fetch('/api/backtest', {
+        method: 'POST',
+        headers: headers,
+        body: body,
+        signal: signal
+    });
+
+    if (res.status === 304 && cached) {
+        resultCache.delete(body);
+        resultCache.set(body, cached);
+        return decodeBinaryResult(cached.buffer);
+    }
+    if (!res.ok) {
+        const err = await res.json();
+        throw new Error(err.detail || "請求失敗");
+    }
+
+    const buffer = await res.arrayBuffer();
+    const etag = res.headers.get('ETag');
+    if (etag) {
+        resultCache.delete(body);
+        resultCache.set(body, { etag, buffer });
+        if (resultCache.size > RESULT_CACHE_SIZE) resultCache.delete(resultCache.keys().next().value);
+    }
+    return decodeBinaryResult(buffer);
+}
+
+// 二進位格式: [uint32 標頭長度][JSON 標頭][little-endian float64 曲線]，曲線直接對應成 Float64Array 不需逐筆解析
+function decodeBinaryResult(buffer) {
+    const headerLength = new DataView(buffer).getUint32(0, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+    const dataStart = 4 + headerLength;
+
+    const series = {};
+    for (const [name, layout] of Object.entries(header.series)) {
+        series[name] = new Float64Array(buffer, dataStart + layout.offset, layout.length);
+    }
+    header.series = series;
+    return header;
+}
+
+// 解析 Server-Sent Events (fetch 串流版本，EventSource 不支援 POST)
+async function readEventStream(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+const MODE_LABELS = { basic: '預設', periodic: '定期定額', advanced: '自定義' };
+
+// 歷史紀錄下拉選單 (最近 30 筆)
+async function refreshHistoryList() {
+    const select = document.getElementById('historySelect');
+    if (!select) return;
+
+    try {
+        const res = await fetch('/api/history?limit=30');
+        if (!res.ok) return;
+        const data = await res.json();
+
+        select.innerHTML = '<option value="">歷史紀錄</option>';
+        data.items.forEach(item => {
+            const opt = document.createElement('option');
+            opt.value = item.id;
+            const ret = (item.total_return > 0 ? '+' : '') + item.total_return + '%';
+            opt.textContent = `${item.ticker} · ${MODE_LABELS[item.strategy_mode] || item.strategy_mode} · ${ret} (${item.start_date} ~ ${item.end_date})`;
+            select.appendChild(opt);
+        });
+    } catch (err) {
+        console.error(err);
+    }
+}
+
+// 從歷史紀錄載入結果 (不重新回測)，可搭配「鎖定曲線」比較不同策略
+async function loadHistoryRun(runId) {
+    if (!runId) return;
+
+    try {
+        const res = await fetch(`/api/history/${runId}`, { headers: { 'Accept': BINARY_MEDIA_TYPE } });
+        if (!res.ok) {
+            const err = await res.json();
+            throw new Error(err.detail || "請求失敗");
+        }
+        updateDashboard(decodeBinaryResult(await res.arrayBuffer()));
+        showToast("已載入歷史紀錄", "success");
+    } catch (err) {
+        showToast('載入失敗: ' + err.message, 'error');
+        console.error(err);
+    } finally {
+        document.getElementById('historySelect').value = '';
+    }
+}
+
 async function shutdownSystem() {
     if (!confirm("確定要關閉系統並停止伺服器嗎？")) return;
 
@@ -682,7 +847,7 @@ function animateCountUp(elementId, targetValue, duration = 1000, isCurrency = fa
     requestAnimationFrame(update);
 }
 
-function updateDashboard(data) {
+function updateSummary(data) {
     updateCard('res_total_return', data.total_return, true);
 
     // 買進持有 - Count Up
@@ -740,6 +905,10 @@ function updateDashboard(data) {
     pnlEl.innerText = (pnlVal > 0 ? '+' : '') + pnlVal.toLocaleString();
 
     document.getElementById('res_consec_loss').innerText = data.max_consecutive_loss + " 次";
+}
+
+function updateDashboard(data, summaryShown = false) {
+    if (!summaryShown) updateSummary(data);
 
     document.getElementById('chartPlaceholder').classList.add('hidden');
     const canvas = document.getElementById('mainChart');
@@ -747,18 +916,17 @@ function updateDashboard(data) {
     document.getElementById('chartContainer').classList.remove('bg-gray-50', 'border', 'border-dashed');
     document.getElementById('chartContainer').classList.add('bg-white', 'dark:bg-slate-800');
 
+    // curves: { dates, equity, roi, drawdown, price, buy_and_hold }，數值為 Float64Array
+    const curves = { dates: data.dates, ...data.series };
+
     lastChartData = {
-        priceData: data.price_data,
+        curves: curves,
         trades: data.trades,
-        equityData: data.equity_curve,
-        bhData: data.buy_and_hold_curve,
-        roiData: data.roi_curve,
-        drawdownCurve: data.drawdown_curve,
         pnlData: data.pnl_histogram
     };
 
-    renderMainChart(data.price_data, data.trades, data.equity_curve, data.buy_and_hold_curve, data.roi_curve);
-    renderDrawdownChart(data.drawdown_curve);
+    renderMainChart(curves, data.trades);
+    renderDrawdownChart(curves);
     renderPnLHistogram(data.pnl_histogram);
     renderHeatmap(data.heatmap_data);
     renderTradeList(data.detailed_trades);
@@ -787,7 +955,7 @@ function updateTableValue(id, value, isGreenRed) {
 // =========================================================
 //  核心圖表繪製
 // =========================================================
-function renderMainChart(priceData, trades, equityData, bhData, roiData = null) {
+function renderMainChart(curves, trades) {
     const ctx = document.getElementById('mainChart').getContext('2d');
     if (mainChart) mainChart.destroy();
 
@@ -798,20 +966,18 @@ function renderMainChart(priceData, trades, equityData, bhData, roiData = null)
     const priceLineColor = isDark ? '#334155' : '#cbd5e1';
     const priceAxisColor = isDark ? '#475569' : '#cbd5e1';
 
-    const labels = priceData.map(d => d.time);
+    const labels = curves.dates;
 
     // 資料計算
     // 如果有後端回傳的 ROI Curve (定期定額模式 or Basic)，直接使用
-    let strategyReturnData = [];
-    if (roiData && roiData.length > 0) {
-        strategyReturnData = roiData.map(d => d.value);
-    } else {
-        const initialEquity = equityData.length > 0 ? equityData[0].value : 1;
-        strategyReturnData = equityData.map(d => ((d.value - initialEquity) / initialEquity) * 100);
+    let strategyReturnData = curves.roi;
+    if (!strategyReturnData || strategyReturnData.length === 0) {
+        const initialEquity = curves.equity.length > 0 ? curves.equity[0] : 1;
+        strategyReturnData = curves.equity.map(v => ((v - initialEquity) / initialEquity) * 100);
     }
 
-    const initialPrice = priceData.length > 0 ? priceData[0].value : 1;
-    const bhReturnData = priceData.map(d => ((d.value - initialPrice) / initialPrice) * 100);
+    const initialPrice = curves.price.length > 0 ? curves.price[0] : 1;
+    const bhReturnData = curves.price.map(v => ((v - initialPrice) / initialPrice) * 100);
     const tradeMap = {};
     // 建立查找表，確保買賣點對齊
     trades.forEach(t => { tradeMap[t.time] = { price: t.price, type: t.type }; });
@@ -853,7 +1019,7 @@ function renderMainChart(priceData, trades, equityData, bhData, roiData = null)
 
     // --- 股價線 ---
     const priceDataset = {
-        label: '股價 (Price)', data: priceData.map(d => d.value),
+        label: '股價 (Price)', data: curves.price,
         borderColor: priceLineColor,
         borderWidth: 1,
         pointRadius: 0, tension: 0.1, fill: false,
@@ -1037,7 +1203,7 @@ function updateCustomLegend(chart) {
 // ---------------------------------------------------------
 //  水下曲線圖 (Drawdown Chart)
 // ---------------------------------------------------------
-function renderDrawdownChart(data) {
+function renderDrawdownChart(curves) {
     const ctx = document.getElementById('drawdownChart').getContext('2d');
     if (drawdownChart) drawdownChart.destroy();
 
@@ -1045,8 +1211,8 @@ function renderDrawdownChart(data) {
     const gridColor = isDark ? '#334155' : '#e5e7eb';
     const textColor = isDark ? '#94a3b8' : '#64748b';
 
-    const labels = data.map(d => d.time);
-    const values = data.map(d => d.value);
+    const labels = curves.dates;
+    const values = curves.drawdown;
 
     drawdownChart = new Chart(ctx, {
         type: 'line',